@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import geom
+import mapp
+import part1
+import robot
+from particles import resamplers
+
+def make_map(map_size, num_walls, seed=0):
+    """
+    Generate a map with a fixed seed.
+    Inputs:
+        map_size: The width and height of the map in meters.
+        num_walls: The number of walls to place.
+        seed: The seed for the random generators.
+    Output:
+        A Map object.
+    """
+    
+    random.seed(seed)
+    np.random.seed(seed)
+    ma = mapp.Map(map_size, map_size, 0.1)
+    ma.fill_floor(100, 8)
+    ma.place_walls(num_walls)
+    return ma
+
+def time_steps(rob, steps):
+    """
+    Time a number of random moves of a robot.
+    Output:
+        The average time per step in seconds.
+    """
+    
+    start = time.perf_counter()
+    for i in range(steps):
+        rob.move(random.gauss(0, 1), 0.5)
+    return (time.perf_counter() - start) / steps
+
+def bench_resampling(sizes, steps=5):
+    """
+    Show how the time of one Robot2.move() step scales with the number
+    of particles, for every resampling strategy.
+    Inputs:
+        sizes: A list with numbers of particles.
+        steps: The number of steps to average over.
+    """
+    
+    ma = make_map(20, 10)
+    
+    print('particles  ' + ''.join(name.rjust(13) for name in resamplers))
+    for num in sizes:
+        line = str(num).ljust(11)
+        for name in resamplers:
+            random.seed(1)
+            np.random.seed(1)
+            rob = robot.Robot2(ma, num)
+            rob.resampling = name
+            rob.put(0, (10.05, 10.05))
+            line += ('%.2f ms' % (1000 * time_steps(rob, steps))).rjust(13)
+        print(line)
+
+def boundary_fraction(ma):
+    """
+    Calculate the fraction of neighbouring pixel pairs that have a
+    different colour. This is a simple statistic to compare the shape of
+    the areas made by different floor generators.
+    """
+    
+    floor = ma.floor_array()
+    horizontal = (floor[:, 1:] != floor[:, :-1]).sum()
+    vertical = (floor[1:] != floor[:-1]).sum()
+    pairs = floor[:, 1:].size + floor[1:].size
+    return (horizontal + vertical) / pairs
+
+def bench_fill_floor(sizes, methods=('random', 'frontier', 'voronoi')):
+    """
+    Compare the time and the area statistics of the floor generators.
+    Inputs:
+        sizes: A list with map sizes in meters.
+        methods: The methods of Map.fill_floor() to compare.
+    """
+    
+    print('size  ' + ''.join(m.rjust(22) for m in methods))
+    for size in sizes:
+        line = str(size).ljust(6)
+        for method in methods:
+            ma = mapp.Map(size, size, 0.1)
+            start = time.perf_counter()
+            ma.fill_floor(100, 8, method=method, seed=size)
+            t = time.perf_counter() - start
+            line += ('%.3f s (%.4f)' % (t, boundary_fraction(ma))).rjust(22)
+        print(line)
+
+def start_pose(ma, size):
+    """
+    Find a random pose on a map that is not too close to a wall.
+    Output:
+        A tuple (angle, (x, y)).
+    """
+    
+    while True:
+        x = random.random() * ma.width
+        y = random.random() * ma.height
+        if ma.closest_wall((x, y)) >= size:
+            return (random.random() * 2*math.pi, (x, y))
+
+def placed_robot(kind, ma, num_particles):
+    """
+    Make a robot and put it on a random free pose.
+    """
+    
+    rob = kind(ma, num_particles)
+    rob.put(*start_pose(ma, rob.size))
+    return rob
+
+def random_moves(rob, steps):
+    """
+    Make a function that moves a robot steps times in random directions.
+    """
+    
+    def run():
+        for i in range(steps):
+            rob.move(random.gauss(0, math.pi/3), 1)
+    return run
+
+def autonome_moves(rob, steps):
+    """
+    Make a function that lets a robot plan and do steps moves.
+    """
+    
+    def run():
+        for i in range(steps):
+            rob.autonome_move()
+    return run
+
+def suite_cases(params, seed):
+    """
+    Get the benchmarks of the suite for one configuration.
+    Inputs:
+        params: The parameters of a part1 test case, see
+            part1.configurations().
+        seed: The seed of the map of the configuration.
+    Output:
+        A list with tuples (name, setup, calls). setup() returns a
+        function that does calls calls of the benchmarked code. The
+        setup is not timed, and the random generators are seeded before
+        every setup.
+    """
+    
+    map_size, resolution, num_areas, num_colours, num_walls, num_particles = params
+    
+    random.seed(seed)
+    np.random.seed(seed)
+    ma = mapp.Map(map_size, map_size, resolution)
+    ma.fill_floor(num_areas, num_colours)
+    ma.place_walls(num_walls)
+    
+    # Random points with the map walls, for the geom functions.
+    def wall_points():
+        points = [
+            (random.random() * ma.width, random.random() * ma.height)
+            for i in range(200)
+        ]
+        return [(p, w) for p in points for w in ma.walls[:50]]
+    
+    def dist_point_line():
+        pairs = wall_points()
+        return lambda: [geom.dist_point_line(p, w) for p, w in pairs]
+    
+    def intersect_lines():
+        pairs = [((p, (p[0]+1, p[1]+1)), w) for p, w in wall_points()]
+        return lambda: [geom.intersect_lines(l, w) for l, w in pairs]
+    
+    def closest_wall():
+        points = [start_pose(ma, 0)[1] for i in range(1000)]
+        return lambda: [ma.closest_wall(p) for p in points]
+    
+    def fill_floor():
+        return lambda: mapp.Map(map_size, map_size, resolution).fill_floor(num_areas, num_colours)
+    
+    def place_walls():
+        return lambda: mapp.Map(map_size, map_size, resolution).place_walls(num_walls)
+    
+    def measure():
+        rob = placed_robot(robot.Robot1, ma, num_particles)
+        poses = [start_pose(ma, 0) for i in range(100)]
+        return lambda: [rob.measure(pose) for pose in poses]
+    
+    def measurement_model():
+        rob = placed_robot(robot.Robot1, ma, num_particles)
+        rob.measurement = rob.measure()
+        return lambda: [rob.measurement_model(p, w) for p, w in rob.particles]
+    
+    return [
+        ('geom.dist_point_line', dist_point_line, 200 * min(len(ma.walls), 50)),
+        ('geom.intersect_lines', intersect_lines, 200 * min(len(ma.walls), 50)),
+        ('Map.closest_wall', closest_wall, 1000),
+        ('Map.fill_floor', fill_floor, 1),
+        ('Map.place_walls', place_walls, 1),
+        ('Robot1.measure', measure, 100),
+        ('Robot1.measurement_model', measurement_model, num_particles),
+        ('Robot1.move', lambda: random_moves(placed_robot(robot.Robot1, ma, num_particles), 5), 5),
+        ('Robot2.move', lambda: random_moves(placed_robot(robot.Robot2, ma, num_particles), 5), 5),
+        ('Robot1.autonome_move', lambda: autonome_moves(placed_robot(robot.Robot1, ma, num_particles), 3), 3),
+        ('Robot2.autonome_move', lambda: autonome_moves(placed_robot(robot.Robot2, ma, num_particles), 3), 3)
+    ]
+
+def time_case(setup, calls, seed, repeat):
+    """
+    Time a benchmark of the suite, see suite_cases().
+    Output:
+        The best time per call in seconds over repeat runs.
+    """
+    
+    best = float('inf')
+    for r in range(repeat):
+        random.seed(seed)
+        np.random.seed(seed)
+        run = setup()
+        start = time.perf_counter()
+        run()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+def run_suite(path, names=None, repeat=3):
+    """
+    Time all benchmarks of the suite for the part1 configurations, and
+    save the results as a JSON baseline.
+    Inputs:
+        path: The file to save the results to.
+        names: A list with the names of the configurations to run, see
+            part1.configurations(). All of them by default.
+        repeat: The number of runs per benchmark. The best run counts.
+    Output:
+        A dictionary that maps configuration names to dictionaries with
+        the time per call of every benchmark.
+    """
+    
+    results = {}
+    for test, cases in part1.configurations().items():
+        for name, params in cases:
+            if names and name not in names:
+                continue
+            
+            seed = part1.iteration_seed(name, 0)
+            results[name] = {}
+            for case, setup, calls in suite_cases(params, seed):
+                t = time_case(setup, calls, seed, repeat)
+                results[name][case] = t
+                print(name.ljust(16) + case.ljust(28) + format_time(t).rjust(12))
+    
+    f = open(path, 'w')
+    json.dump({
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'repeat': repeat,
+        'results': results
+    }, f, indent=1)
+    f.close()
+    
+    return results
+
+def format_time(t):
+    """
+    Format a time in seconds with a suitable unit.
+    """
+    
+    if t < 1e-3:
+        return '%.2f us' % (1e6 * t)
+    if t < 1:
+        return '%.2f ms' % (1e3 * t)
+    return '%.2f s' % t
+
+def compare(baseline_path, current_path, tolerance=0.25):
+    """
+    Compare two results files of run_suite() and flag the benchmarks
+    that became slower.
+    Inputs:
+        baseline_path: The file with the reference results.
+        current_path: The file with the new results.
+        tolerance: The relative slowdown that is still accepted.
+    Output:
+        The number of regressions.
+    """
+    
+    f = open(baseline_path)
+    baseline = json.load(f)['results']
+    f.close()
+    f = open(current_path)
+    current = json.load(f)['results']
+    f.close()
+    
+    regressions = 0
+    for name in current:
+        for case, t in current[name].items():
+            if case not in baseline.get(name, {}):
+                continue
+            
+            ratio = t / baseline[name][case]
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(
+                name.ljust(16) + case.ljust(28) +
+                format_time(baseline[name][case]).rjust(12) +
+                format_time(t).rjust(12) +
+                ('%.2fx' % ratio).rjust(9) + flag
+            )
+    
+    print(str(regressions) + ' regression(s)')
+    return regressions
+
+benchmarks = {
+    'resampling': (bench_resampling, [100, 1000, 10000, 30000]),
+    'floor': (bench_fill_floor, [15, 20, 25, 30])
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the benchmarks.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    for name in benchmarks:
+        sub = commands.add_parser(name, help='Run the ' + name + ' benchmark.')
+        sub.add_argument('sizes', nargs='*', type=int)
+    
+    sub = commands.add_parser('suite',
+        help='Time the hot paths for the part1 configurations.')
+    sub.add_argument('output', help='The JSON file for the results.')
+    sub.add_argument('--config', action='append',
+        help='Only run this configuration (default: all).')
+    sub.add_argument('--repeat', type=int, default=3,
+        help='The number of runs per benchmark (default: 3).')
+    
+    sub = commands.add_parser('compare',
+        help='Compare suite results with a baseline.')
+    sub.add_argument('baseline', help='The JSON file with the baseline.')
+    sub.add_argument('current', help='The JSON file with the new results.')
+    sub.add_argument('--tolerance', type=float, default=0.25,
+        help='The accepted relative slowdown (default: 0.25).')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'suite':
+        run_suite(args.output, args.config, args.repeat)
+    elif args.command == 'compare':
+        sys.exit(1 if compare(args.baseline, args.current, args.tolerance) else 0)
+    else:
+        function, sizes = benchmarks[args.command]
+        function(args.sizes or sizes)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from memo import LRUCache
+
+class RunLengthFloor:
+    
+    def __init__(self, starts, values, size):
+        """
+        Initialize a read-only floor that is stored as runs of pixels
+        with the same colour, in the row by row order of Map.floor.
+        Since the floor areas are large, there are far fewer runs than
+        pixels. A pixel is found with a binary search in the starts of
+        the runs. Use RunLengthFloor.compress() to make one.
+        Inputs:
+            starts: An increasing array with the index of the first pixel
+                of every run. The first run starts at 0.
+            values: An array with the colour of every run.
+            size: The total number of pixels.
+        """
+        
+        # 32 bit starts are enough for floors up to 2**31 pixels.
+        dtype = np.int32 if size < 2**31 else np.int64
+        self.starts = np.asarray(starts, dtype=dtype)
+        self.values = np.asarray(values, dtype=np.uint8)
+        self.size = size
+    
+    @classmethod
+    def compress(cls, floor):
+        """
+        Encode a floor buffer.
+        Inputs:
+            floor: A bytes-like object or a uint8 array with one value
+                per pixel.
+        Output:
+            A RunLengthFloor.
+        """
+        
+        flat = np.frombuffer(floor, dtype=np.uint8).ravel()
+        starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+        return cls(starts, flat[starts], len(flat))
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, index):
+        """
+        Get the colour of a pixel, like for a floor buffer.
+        Inputs:
+            index: The index of the pixel, wpix*y + x.
+        """
+        
+        if not 0 <= index < self.size:
+            raise IndexError('floor index out of range')
+        run = np.searchsorted(self.starts, index, side='right') - 1
+        return int(self.values[run])
+    
+    def __setitem__(self, index, value):
+        raise TypeError('a run-length encoded floor is read-only')
+    
+    def __bytes__(self):
+        return self.array().tobytes()
+    
+    def lookup(self, indices):
+        """
+        Get the colours of many pixels at once.
+        Inputs:
+            indices: An array with pixel indices, wpix*y + x.
+        Output:
+            A uint8 array with the colours.
+        """
+        
+        runs = np.searchsorted(self.starts, indices, side='right') - 1
+        return self.values[runs]
+    
+    def array(self):
+        """
+        Decode the floor.
+        Output:
+            A new uint8 array with one value per pixel.
+        """
+        
+        lengths = np.diff(np.append(self.starts, self.size))
+        return np.repeat(self.values, lengths)
+    
+    def nbytes(self):
+        """
+        Get the memory used by the runs in bytes.
+        """
+        
+        return self.starts.nbytes + self.values.nbytes
+
+class TiledFloor:
+    
+    def __init__(self, wpix, hpix, seeds, tile_size=256, max_bytes=2**24):
+        """
+        Initialize a read-only floor that is generated in square tiles
+        when they are first used. Every pixel gets the colour of the
+        closest seed, as in Map.fill_voronoi(), so the floor does not
+        depend on which tiles were generated first. Only the most
+        recently used tiles are kept, the others are generated again
+        when they are needed.
+        Inputs:
+            wpix: The width of the floor in pixels.
+            hpix: The height of the floor in pixels.
+            seeds: A list with the seeds ((x, y), colour) in pixels.
+            tile_size: The width and height of a tile in pixels.
+            max_bytes: The memory for the kept tiles in bytes.
+        """
+        
+        self.wpix = wpix
+        self.hpix = hpix
+        self.size = wpix * hpix
+        self.seeds = seeds
+        self.seed_x = np.array([s[0][0] for s in seeds], dtype=np.int64)
+        self.seed_y = np.array([s[0][1] for s in seeds], dtype=np.int64)
+        self.colours = np.array([s[1] for s in seeds], dtype=np.uint8)
+        
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self.columns = -(-wpix // tile_size)
+        self.tiles = LRUCache(max(max_bytes // tile_size**2, 1))
+    
+    def __getstate__(self):
+        """
+        Leave the tiles out when the floor is pickled.
+        """
+        
+        state = dict(self.__dict__)
+        state['tiles'] = LRUCache(self.tiles.size)
+        return state
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, index):
+        """
+        Get the colour of a pixel, like for a floor buffer.
+        Inputs:
+            index: The index of the pixel, wpix*y + x.
+        """
+        
+        if not 0 <= index < self.size:
+            raise IndexError('floor index out of range')
+        y, x = divmod(index, self.wpix)
+        i, j = x // self.tile_size, y // self.tile_size
+        tile = self.tile(i, j)
+        return int(tile[y - j*self.tile_size, x - i*self.tile_size])
+    
+    def __setitem__(self, index, value):
+        raise TypeError('a tiled floor is read-only')
+    
+    def __bytes__(self):
+        return self.array().tobytes()
+    
+    def tile(self, i, j):
+        """
+        Get a tile, and generate it if it is not kept.
+        Inputs:
+            i: The column of the tile.
+            j: The row of the tile.
+        Output:
+            A uint8 array of shape (tile_size, tile_size), smaller for
+            the tiles at the right and top edges.
+        """
+        
+        tile = self.tiles.get((i, j))
+        if tile is None:
+            tile = self.generate(i, j)
+            self.tiles.put((i, j), tile)
+        return tile
+    
+    def generate(self, i, j):
+        """
+        Calculate the colours of a tile, see self.tile().
+        """
+        
+        x0 = i * self.tile_size
+        y0 = j * self.tile_size
+        x1 = min(x0 + self.tile_size, self.wpix) - 1
+        y1 = min(y0 + self.tile_size, self.hpix) - 1
+        
+        # Only the seeds that can be the closest seed of a pixel in the
+        # tile are needed: those whose distance to the tile is not
+        # larger than the largest distance from some seed to the tile.
+        # Their order is kept, so ties resolve like in fill_voronoi().
+        near_x = np.maximum(np.maximum(x0 - self.seed_x, self.seed_x - x1), 0)
+        near_y = np.maximum(np.maximum(y0 - self.seed_y, self.seed_y - y1), 0)
+        far_x = np.maximum(np.abs(self.seed_x - x0), np.abs(self.seed_x - x1))
+        far_y = np.maximum(np.abs(self.seed_y - y0), np.abs(self.seed_y - y1))
+        keep = near_x**2 + near_y**2 <= (far_x**2 + far_y**2).min()
+        seed_x = self.seed_x[keep]
+        seed_y = self.seed_y[keep]
+        colours = self.colours[keep]
+        
+        x = np.arange(x0, x1+1)
+        tile = np.empty((y1-y0+1, x1-x0+1), dtype=np.uint8)
+        for y in range(y0, y1+1):
+            d = (x[:, np.newaxis] - seed_x)**2 + (y - seed_y)**2
+            tile[y-y0] = colours[d.argmin(axis=1)]
+        return tile
+    
+    def lookup(self, indices):
+        """
+        Get the colours of many pixels at once, one tile at a time.
+        Inputs:
+            indices: An array with pixel indices, wpix*y + x.
+        Output:
+            A uint8 array with the colours.
+        """
+        
+        y, x = np.divmod(np.asarray(indices), self.wpix)
+        i = x // self.tile_size
+        j = y // self.tile_size
+        keys = j * self.columns + i
+        
+        colours = np.empty(keys.shape, dtype=np.uint8)
+        for key in np.unique(keys).tolist():
+            ti, tj = key % self.columns, key // self.columns
+            selected = keys == key
+            colours[selected] = self.tile(ti, tj)[
+                y[selected] - tj*self.tile_size,
+                x[selected] - ti*self.tile_size
+            ]
+        return colours
+    
+    def array(self):
+        """
+        Generate the whole floor, without keeping the tiles.
+        Output:
+            A new uint8 array with one value per pixel.
+        """
+        
+        floor = np.empty((self.hpix, self.wpix), dtype=np.uint8)
+        for j in range(-(-self.hpix // self.tile_size)):
+            for i in range(self.columns):
+                y0 = j * self.tile_size
+                x0 = i * self.tile_size
+                floor[y0:y0+self.tile_size, x0:x0+self.tile_size] = self.generate(i, j)
+        return floor.ravel()
+    
+    def nbytes(self):
+        """
+        Get the memory used by the kept tiles in bytes.
+        """
+        
+        return sum(tile.nbytes for tile in self.tiles.items.values())
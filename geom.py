@@ -2,6 +2,8 @@
 
 import math
 
+import numpy as np
+
 def dist_line_line(l1, l2):
     """
     Calculate the distance between two line segments.
@@ -94,3 +96,223 @@ def intersect_lines(l1, l2):
         return (float('inf'), float('inf'))
     else:
         return (t1/n, t2/n)
+
+
+def dist_points_lines(x, y, lines):
+    """
+    Calculate the distances between many points and many line segments
+    at once. This is the array version of dist_point_line().
+    Inputs:
+        x: An array with the x-coordinates of the points.
+        y: An array with the y-coordinates of the points, with the same
+            shape as x.
+        lines: An array of shape (num_lines, 4) where each row is a line
+            segment (x1, y1, x2, y2). It can also have shape
+            x.shape + (num_lines, 4) to use different lines per point.
+    Output:
+        An array of shape x.shape + (num_lines,) with the distance
+        between every point and every line segment.
+    """
+    
+    x = np.asarray(x, dtype=float)[..., np.newaxis]
+    y = np.asarray(y, dtype=float)[..., np.newaxis]
+    lines = np.asarray(lines, dtype=float)
+    x1, y1, x2, y2 = lines[..., 0], lines[..., 1], lines[..., 2], lines[..., 3]
+    
+    # Project the points on the lines and clip the projection parameter
+    # to the segment, exactly like dist_point_line() does.
+    dx = x2 - x1
+    dy = y2 - y1
+    sqnorm = np.maximum(dx**2 + dy**2, 1e-12)
+    t = np.clip(((x - x1) * dx + (y - y1) * dy) / sqnorm, 0, 1)
+    
+    return np.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+
+def cast_rays(x, y, angles, lines, max_range):
+    """
+    Cast rays from many origins under many angles at once, and find the
+    closest line segment hit in the positive and negative direction of
+    every ray. This gives the same result as calling intersect_lines()
+    for every ray (with unit length) and every line segment.
+    Inputs:
+        x: An array with the x-coordinates of the origins.
+        y: An array with the y-coordinates of the origins.
+        angles: An array of shape (num_angles,) with the angles of the
+            rays, or of shape (num_origins, num_angles) to use
+            different angles per origin.
+        lines: An array of shape (num_lines, 4) where each row is a line
+            segment (x1, y1, x2, y2).
+        max_range: The distance that is returned when nothing is hit.
+    Output:
+        A tuple (pos, neg) of arrays of shape (num_origins, num_angles).
+        pos contains the positive distances to the closest hit in the
+        direction of the ray, neg the negative distances to the closest
+        hit in the opposite direction.
+    """
+    
+    x = np.asarray(x, dtype=float).reshape(-1, 1, 1)
+    y = np.asarray(y, dtype=float).reshape(-1, 1, 1)
+    angles = np.asarray(angles, dtype=float)
+    angles = np.broadcast_to(angles, (x.shape[0], angles.shape[-1]))[..., np.newaxis]
+    lines = np.asarray(lines, dtype=float)
+    x1, y1, x2, y2 = lines[:, 0], lines[:, 1], lines[:, 2], lines[:, 3]
+    
+    # The same formulas as in intersect_lines(), with
+    # l1 = ((x, y), (x + cos(angle), y + sin(angle))) and l2 = a line.
+    dx = np.cos(angles)
+    dy = np.sin(angles)
+    n = (x2 - x1) * -dy + dx * (y2 - y1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1 = ((y1 - y2) * (x - x1) - (x1 - x2) * (y - y1)) / n
+        t2 = (-dy * (x - x1) + dx * (y - y1)) / n
+    
+    # Only keep the hits that lie on the line segments. Parallel lines
+    # (n == 0) never hit.
+    hit = (n != 0) & (t2 >= 0) & (t2 <= 1)
+    pos = np.where(hit & (t1 > 0), t1, max_range).min(axis=-1, initial=max_range)
+    neg = np.where(hit & (t1 < 0), t1, -max_range).max(axis=-1, initial=-max_range)
+    
+    return pos, neg
+
+def sweep_circle_line(p0, p1, r, l):
+    """
+    Calculate when a circle that moves in a straight line first touches
+    a line segment.
+    Inputs:
+        p0: A tuple (x, y) with the start position of the centre.
+        p1: A tuple (x, y) with the end position of the centre.
+        r: The radius of the circle.
+        l: A tuple with the begin and end points of the line segment:
+            ((x1, y1), (x2, y2))
+    Output:
+        The parameter t in [0, 1] for which the centre at
+        p0 + t*(p1-p0) is at distance r of the line segment for the
+        first time, or float('inf') if the circle never touches it. If
+        the circle already overlaps the segment at p0, t is 0.
+    """
+    
+    vx = p1[0] - p0[0]
+    vy = p1[1] - p0[1]
+    
+    # The circle touches the segment when its centre enters the capsule
+    # around the segment: the union of a disc around each end point and
+    # a rectangle around the interior.
+    t = min(
+        _enter_disc(p0, vx, vy, l[0], r),
+        _enter_disc(p0, vx, vy, l[1], r)
+    )
+    
+    # Clip the movement with the 4 sides of the rectangle: the
+    # distance to the line must be at most r and the projection must
+    # lie on the segment.
+    lx = l[1][0] - l[0][0]
+    ly = l[1][1] - l[0][1]
+    length = math.hypot(lx, ly)
+    wx, wy = lx / length, ly / length
+    qx, qy = p0[0] - l[0][0], p0[1] - l[0][1]
+    s = wy*qx - wx*qy
+    ds = wy*vx - wx*vy
+    u = wx*qx + wy*qy
+    du = wx*vx + wy*vy
+    
+    lo, hi = 0, 1
+    for g, h in [(ds, r - s), (-ds, r + s), (-du, u), (du, length - u)]:
+        # Constraint g*t <= h.
+        if g == 0:
+            if h < 0:
+                lo, hi = 1, 0
+        elif g > 0:
+            hi = min(hi, h / g)
+        else:
+            lo = max(lo, h / g)
+    if lo <= hi:
+        t = min(t, lo)
+    
+    return t if t <= 1 else float('inf')
+
+def _enter_disc(p0, vx, vy, c, r):
+    """
+    Get the smallest t >= 0 for which p0 + t*(vx, vy) lies in the disc
+    with centre c and radius r, or float('inf').
+    """
+    
+    qx = p0[0] - c[0]
+    qy = p0[1] - c[1]
+    a = vx**2 + vy**2
+    b = 2 * (qx*vx + qy*vy)
+    c = qx**2 + qy**2 - r**2
+    
+    if c <= 0:
+        return 0
+    disc = b**2 - 4*a*c
+    if a == 0 or disc < 0:
+        return float('inf')
+    
+    # Both roots have the same sign, because c > 0.
+    t = (-b - math.sqrt(disc)) / (2*a)
+    return t if t >= 0 else float('inf')
+
+def sweep_circles_lines(x, y, vx, vy, r, lines):
+    """
+    Calculate when many moving circles first touch many line segments.
+    This is the array version of sweep_circle_line().
+    Inputs:
+        x: An array with the x-coordinates of the start positions.
+        y: An array with the y-coordinates of the start positions.
+        vx: An array with the movements in the x-direction.
+        vy: An array with the movements in the y-direction.
+        r: The radius of the circles.
+        lines: An array of shape (num_lines, 4) where each row is a line
+            segment (x1, y1, x2, y2), or of shape x.shape + (num_lines,
+            4) to use different lines per circle.
+    Output:
+        An array of shape x.shape + (num_lines,) with the parameters t
+        of the first contact, or inf if there is none.
+    """
+    
+    x = np.asarray(x, dtype=float)[..., np.newaxis]
+    y = np.asarray(y, dtype=float)[..., np.newaxis]
+    vx = np.asarray(vx, dtype=float)[..., np.newaxis]
+    vy = np.asarray(vy, dtype=float)[..., np.newaxis]
+    lines = np.asarray(lines, dtype=float)
+    x1, y1, x2, y2 = lines[..., 0], lines[..., 1], lines[..., 2], lines[..., 3]
+    
+    a = vx**2 + vy**2
+    t = np.full(np.broadcast(x, x1).shape, np.inf)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        
+        # The discs around the end points.
+        for cx, cy in ((x1, y1), (x2, y2)):
+            qx = x - cx
+            qy = y - cy
+            b = 2 * (qx*vx + qy*vy)
+            c = qx**2 + qy**2 - r**2
+            disc = b**2 - 4*a*c
+            enter = (-b - np.sqrt(np.maximum(disc, 0))) / (2*a)
+            enter = np.where((disc >= 0) & (a > 0) & (enter >= 0), enter, np.inf)
+            t = np.minimum(t, np.where(c <= 0, 0, enter))
+        
+        # The rectangle around the interior.
+        lx = x2 - x1
+        ly = y2 - y1
+        length = np.maximum(np.hypot(lx, ly), 1e-12)
+        wx = lx / length
+        wy = ly / length
+        qx = x - x1
+        qy = y - y1
+        s = wy*qx - wx*qy
+        ds = wy*vx - wx*vy
+        u = wx*qx + wy*qy
+        du = wx*vx + wy*vy
+        
+        lo = np.zeros(t.shape)
+        hi = np.ones(t.shape)
+        for g, h in [(ds, r - s), (-ds, r + s), (-du, u), (du, length - u)]:
+            bound = h / g
+            lo = np.where(g < 0, np.maximum(lo, bound), lo)
+            hi = np.where(g > 0, np.minimum(hi, bound), hi)
+            hi = np.where((g == 0) & (h < 0), -np.inf, hi)
+        t = np.minimum(t, np.where(lo <= hi, lo, np.inf))
+    
+    return np.where(t <= 1, t, np.inf)
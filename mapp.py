@@ -3,32 +3,123 @@
 from PIL import Image, ImageDraw
 import random
 import math
+import mmap
+import os
 import shelve
+import struct
+
+import numpy as np
 
 import geom
+from wallgrid import WallGrid
+from scantable import ScanTable
+from particles import ParticleSet
+from floors import RunLengthFloor, TiledFloor
+
+# The binary map format of Map.save_binary(). The file starts with a
+# header, followed by the walls as float64 (x1, y1, x2, y2) rows. The
+# raw floor starts at floor_offset, which is a multiple of
+# binary_alignment so that it can be memory-mapped on every platform.
+# If bit 0 of the flags is set (version 2), the floor is run-length
+# encoded instead: the number of runs as uint64, the int64 starts and
+# the uint8 colours of the runs, see floors.RunLengthFloor. If bit 1 is
+# set (version 3), only the seeds of a tiled floor are stored: the tile
+# size as uint32, the number of seeds as uint64, and the int64 x, int64
+# y and uint8 colours of the seeds, see floors.TiledFloor.
+# After the floor follow optional sections, each with a tag and a
+# length: b'DFLD' for the distance field and b'SCAN' for the scan table.
+binary_magic = b'RMAP'
+binary_version = 3
+binary_alignment = 65536
+binary_header = struct.Struct('<4sHHdddIIQQ')
+binary_section = struct.Struct('<4sQ')
+binary_runs = struct.Struct('<Q')
+binary_compressed = 1
+binary_tiles = struct.Struct('<IQ')
+binary_tiled = 2
+binary_field = struct.Struct('<d8sII')
+binary_scans = struct.Struct('<IddIQ')
 
 class Map:
     
     wall_spacing = 0.8
+    index_cell_size = 2 # Cell size of the wall index in meters.
     
-    def __init__(self, width, height, resolution):
+    def __init__(self, width, height, resolution, allocate_floor=True):
         """
         Initialize the map.
         Inputs:
             width: The width of the map in meters.
             height: The height of the map in meters.
             resolution: The size of a pixel in meters.
+            allocate_floor: If False, the floor is not allocated, so it
+                must be made with self.fill_floor() or self.load() before
+                it is used.
         """
         
         self.walls = []
+        self.wall_array = np.empty((0, 4))
         
         self.width = width
         self.height = height
         self.resolution = resolution
         
+        # Bucket grid over the walls, used for the exact wall queries.
+        self.index = WallGrid(width, height, self.index_cell_size)
+        
         self.wpix = int(math.ceil(width / resolution)) + 1
         self.hpix = int(math.ceil(height / resolution)) + 1
-        self.floor = [255 for i in range(self.wpix * self.hpix)]
+        
+        # The floor is stored row by row with one byte per pixel.
+        self.floor = None
+        if allocate_floor:
+            self.floor = bytearray(b'\xff') * (self.wpix * self.hpix)
+        
+        # Cache with the static floor and wall layers of self.draw().
+        # It is cleared by self.changed().
+        self.layers = {}
+        
+        # Optional grid with precomputed distances to the closest wall,
+        # see self.build_distance_field().
+        self.field = None
+        self.field_resolution = resolution
+        self.field_lookup = 'bilinear'
+        
+        # When field_check is True, every lookup in the distance field
+        # is compared with an exact scan, see self.field_error().
+        self.field_check = False
+        self.field_stats = {'samples': 0, 'total': 0, 'max': 0}
+        
+        # Optional lazily filled table with exact range scans, see
+        # self.use_scan_table().
+        self.scan_table = None
+        
+        # The file and offset (path, offset) of a memory-mapped floor
+        # without local changes, see self.load_binary().
+        self.floor_source = None
+    
+    def __getstate__(self):
+        """
+        Pickle a memory-mapped floor (see self.load_binary()) as its
+        file and offset, for example for the worker processes of the
+        planner, so that all processes share the mapped pages. A floor
+        with local changes is copied instead.
+        """
+        
+        state = dict(self.__dict__)
+        if isinstance(self.floor, mmap.mmap):
+            state['floor'] = None if self.floor_source else bytearray(self.floor)
+        return state
+    
+    def __setstate__(self, state):
+        """
+        Map the floor of a pickled map read-only, see
+        self.__getstate__().
+        """
+        
+        self.__dict__.update(state)
+        if self.floor is None and state.get('floor_source') is not None:
+            self.map_floor(*self.floor_source, mmap.ACCESS_READ)
     
     def get_pixel(self, coor):
         """
@@ -50,6 +141,74 @@ class Map:
         """
         
         self.floor[self.wpix*coor[1] + coor[0]] = value
+        self.floor_source = None
+        if self.layers:
+            self.changed()
+    
+    def changed(self, floor=False):
+        """
+        Forget the cached image layers. Call this after changing the
+        floor or the walls directly.
+        Inputs:
+            floor: True if the floor was changed, for example through
+                self.floor_array(), so that a memory-mapped floor is
+                copied when the map is pickled, see self.__getstate__().
+        """
+        
+        self.layers = {}
+        if floor:
+            self.floor_source = None
+    
+    def floor_array(self):
+        """
+        Get the floor as an array, without copying it. A compressed or
+        tiled floor (see self.compress_floor() and self.fill_floor()) is
+        decoded into a new array instead, so changes to it are not
+        stored.
+        Output:
+            A uint8 array of shape (hpix, wpix) that shares its memory
+            with self.floor.
+        """
+        
+        if isinstance(self.floor, (RunLengthFloor, TiledFloor)):
+            return self.floor.array().reshape(self.hpix, self.wpix)
+        return np.frombuffer(self.floor, dtype=np.uint8).reshape(self.hpix, self.wpix)
+    
+    def compress_floor(self):
+        """
+        Store the floor as runs of pixels with the same colour, see
+        floors.RunLengthFloor. This takes far less memory for the large
+        areas of self.fill_floor(), at the cost of a binary search per
+        lookup. The compressed floor is read-only, so call this after
+        the floor has been filled. self.decompress_floor() undoes it.
+        """
+        
+        if not isinstance(self.floor, RunLengthFloor):
+            self.floor = RunLengthFloor.compress(bytes(self.floor))
+            self.changed()
+    
+    def decompress_floor(self):
+        """
+        Store a compressed or tiled floor as one byte per pixel again.
+        """
+        
+        if isinstance(self.floor, (RunLengthFloor, TiledFloor)):
+            self.floor = bytearray(bytes(self.floor))
+            self.changed()
+    
+    def get_pixels(self, x, y):
+        """
+        Get the values of many pixels on the floor at once.
+        Inputs:
+            x: An array with the x pixel coordinates.
+            y: An array with the y pixel coordinates.
+        Output:
+            A uint8 array with the pixel values.
+        """
+        
+        if isinstance(self.floor, (RunLengthFloor, TiledFloor)):
+            return self.floor.lookup(np.asarray(y) * self.wpix + x)
+        return self.floor_array()[y, x]
     
     def is_empty(self, coor):
         """
@@ -75,6 +234,33 @@ class Map:
         y = self.hpix - int(round(coor[1]/self.resolution)) - 1
         return (x, y)
     
+    def coors_to_pixels(self, x, y):
+        """
+        Convert many coordinates in meters to pixel coordinates at once,
+        like self.coor_to_pixel().
+        Inputs:
+            x: An array with x-coordinates.
+            y: An array with y-coordinates.
+        Output:
+            A tuple (x, y) of integer arrays.
+        """
+        
+        px = np.round(np.asarray(x) / self.resolution).astype(int)
+        py = self.hpix - np.round(np.asarray(y) / self.resolution).astype(int) - 1
+        return (px, py)
+    
+    def get_coordinates(self, x, y):
+        """
+        Get the colours of many coordinates in meters at once.
+        Inputs:
+            x: An array with x-coordinates.
+            y: An array with y-coordinates.
+        Output:
+            A uint8 array with the colours.
+        """
+        
+        return self.get_pixels(*self.coors_to_pixels(x, y))
+    
     def get_coordinate(self, coor):
         """
         Get the colour of a coordinate in meters.
@@ -86,22 +272,237 @@ class Map:
         
         return self.get_pixel(self.coor_to_pixel(coor))
     
-    def closest_wall(self, coor):
+    def closest_wall(self, coor, exact=False):
         """
-        Calculate the distance to the closest wall in meters.
+        Calculate the distance to the closest wall in meters. If a
+        distance field has been built, it is used to look up the
+        distance, unless exact is True or coor lies outside the map.
         Inputs:
             coor: A tuple (x, y).
+            exact: A boolean that forces a scan over all walls.
         Output:
             The distance to the closest wall.
         """
         
-        min_d = float('inf')
+        if self.field is not None and not exact:
+            d = self.lookup_distance(coor)
+            if d is not None:
+                if self.field_check:
+                    self.record_field_error(d, self.closest_wall(coor, exact=True))
+                return d
+        
+        return self.index.nearest(coor)
+    
+    def add_walls(self, walls):
+        """
+        Add walls to the map.
+        Inputs:
+            walls: A list with walls of the form ((x1, y1), (x2, y2)).
+        """
+        
+        self.walls.extend(walls)
+        self.wall_array = np.array(self.walls, dtype=float).reshape(-1, 4)
+        for wall in walls:
+            self.index.insert(wall)
+        self.changed()
+    
+    def update_walls(self):
+        """
+        Rebuild the packed wall array and the wall index after
+        self.walls has been replaced. Rows of self.wall_array are of the
+        form (x1, y1, x2, y2).
+        """
+        
+        self.wall_array = np.array(self.walls, dtype=float).reshape(-1, 4)
+        self.index = WallGrid(self.width, self.height, self.index_cell_size)
         for wall in self.walls:
-            d = geom.dist_point_line(coor, wall)
-            if d < min_d:
-                min_d = d
+            self.index.insert(wall)
+        self.changed()
+    
+    def closest_walls(self, x, y, exact=False):
+        """
+        Calculate the distance to the closest wall for many points at
+        once. This is the array version of self.closest_wall().
+        Inputs:
+            x: An array with x-coordinates in meters.
+            y: An array with y-coordinates in meters.
+            exact: A boolean that forces a scan over all walls.
+        Output:
+            An array with the same shape as x with the distances.
+        """
+        
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        d = np.empty(x.shape)
+        scan = np.ones(x.shape, dtype=bool)
+        
+        if self.field is not None and not exact:
+            d, inside = self.lookup_distances(x, y)
+            if self.field_check:
+                self.record_field_error(d[inside], self.scan_walls(x[inside], y[inside]))
+            scan = ~inside
+        
+        d[scan] = self.scan_walls(x[scan], y[scan])
+        return d
+    
+    def scan_walls(self, x, y):
+        """
+        Calculate the exact distance to the closest wall for an array of
+        points, by comparing every point with every wall.
+        """
+        
+        d = np.empty(len(x))
+        
+        # Work in chunks to limit the size of the intermediate array.
+        chunk = 4096
+        for i in range(0, len(x), chunk):
+            dists = geom.dist_points_lines(x[i:i+chunk], y[i:i+chunk], self.wall_array)
+            d[i:i+chunk] = dists.min(axis=-1, initial=float('inf'))
+        
+        return d
+    
+    def build_distance_field(self, resolution=None, lookup=None):
+        """
+        Precompute the distance to the closest wall on a regular grid
+        that covers the map, so that self.closest_wall() becomes a
+        lookup instead of a scan over all walls. The field must be
+        rebuilt when the walls change, so call this after
+        self.place_walls().
+        Inputs:
+            resolution: The distance between grid points in meters.
+                Defaults to self.field_resolution.
+            lookup: 'bilinear' to interpolate between the 4 surrounding
+                grid points, or 'nearest' to use the closest one.
+                Defaults to self.field_lookup.
+        """
+        
+        if resolution is not None:
+            self.field_resolution = resolution
+        if lookup is not None:
+            self.field_lookup = lookup
+        
+        nx = int(math.ceil(self.width / self.field_resolution)) + 1
+        ny = int(math.ceil(self.height / self.field_resolution)) + 1
+        xs = np.arange(nx) * self.field_resolution
+        # Calculate the field row by row, so that the intermediate
+        # array with the distance to every wall stays small.
+        field = np.empty((ny, nx))
+        for j in range(ny):
+            y = np.full(nx, j * self.field_resolution)
+            field[j] = geom.dist_points_lines(xs, y, self.wall_array).min(axis=1)
+        
+        self.field = field
+        self.field_stats = {'samples': 0, 'total': 0, 'max': 0}
+    
+    def lookup_distance(self, coor):
+        """
+        Look up the distance to the closest wall in the distance field.
+        Inputs:
+            coor: A tuple (x, y).
+        Output:
+            The approximated distance, or None if coor lies outside the
+            field.
+        """
+        
+        ny, nx = self.field.shape
+        gx = coor[0] / self.field_resolution
+        gy = coor[1] / self.field_resolution
+        if gx < 0 or gy < 0 or gx > nx-1 or gy > ny-1:
+            return None
+        
+        if self.field_lookup == 'nearest':
+            return float(self.field[int(round(gy)), int(round(gx))])
+        
+        # Interpolate between the 4 grid points around coor.
+        i = min(int(gx), nx-2)
+        j = min(int(gy), ny-2)
+        fx = gx - i
+        fy = gy - j
+        f = self.field
+        return float(
+            (1-fy) * ((1-fx) * f[j, i] + fx * f[j, i+1]) +
+            fy * ((1-fx) * f[j+1, i] + fx * f[j+1, i+1])
+        )
+    
+    def lookup_distances(self, x, y):
+        """
+        Look up the distances to the closest wall for many points at
+        once. This is the array version of self.lookup_distance().
+        Inputs:
+            x: An array with x-coordinates.
+            y: An array with y-coordinates.
+        Output:
+            A tuple (d, inside) of arrays with the shape of x. d holds
+            the distances for the points where inside is True, the
+            other points lie outside the field.
+        """
+        
+        ny, nx = self.field.shape
+        gx = x / self.field_resolution
+        gy = y / self.field_resolution
+        inside = (gx >= 0) & (gy >= 0) & (gx <= nx-1) & (gy <= ny-1)
+        gx = np.where(inside, gx, 0)
+        gy = np.where(inside, gy, 0)
+        f = self.field
+        
+        if self.field_lookup == 'nearest':
+            return f[np.round(gy).astype(int), np.round(gx).astype(int)], inside
+        
+        # Interpolate between the 4 grid points around every point.
+        i = np.minimum(gx.astype(int), nx-2)
+        j = np.minimum(gy.astype(int), ny-2)
+        fx = gx - i
+        fy = gy - j
+        d = (
+            (1-fy) * ((1-fx) * f[j, i] + fx * f[j, i+1]) +
+            fy * ((1-fx) * f[j+1, i] + fx * f[j+1, i+1])
+        )
+        return d, inside
+    
+    def record_field_error(self, approx, exact):
+        """
+        Add the differences between distances from the field and exact
+        distances to self.field_stats.
+        Inputs:
+            approx: A distance or an array of distances from the field.
+            exact: The corresponding exact distances.
+        """
+        
+        error = np.abs(np.asarray(approx) - np.asarray(exact))
+        if error.size:
+            self.field_stats['samples'] += error.size
+            self.field_stats['total'] += float(error.sum())
+            self.field_stats['max'] = max(self.field_stats['max'], float(error.max()))
+    
+    def field_error(self):
+        """
+        Report the approximation error of the distance field, measured
+        on all lookups done since self.field_check was turned on.
+        Output:
+            A dictionary with the number of samples and the mean and
+            maximal absolute error in meters.
+        """
+        
+        stats = self.field_stats
+        return {
+            'samples': stats['samples'],
+            'mean': stats['total'] / stats['samples'] if stats['samples'] else 0,
+            'max': stats['max']
+        }
+    
+    def use_scan_table(self, half_measures, max_range, cell_size=0.2, angle_bins=1):
+        """
+        Start caching exact range scans in a ScanTable, so that exact
+        scans of robot.Robot1 become table lookups. The table is saved
+        with the map by self.save().
+        Inputs:
+            half_measures: The number of beams per scan.
+            max_range: The maximal measuring distance.
+            cell_size: The distance between the positions in the table.
+            angle_bins: The number of robot orientations in the table.
+        """
         
-        return min_d
+        self.scan_table = ScanTable(self, half_measures, max_range, cell_size, angle_bins)
     
     def intersect_wall(self, line):
         """
@@ -112,20 +513,42 @@ class Map:
             True if the line intersects at least one wall.
         """
         
-        for wall in self.walls:
-            if geom.dist_line_line(line, wall) == 0:
+        box = (
+            (min(line[0][0], line[1][0]), min(line[0][1], line[1][1])),
+            (max(line[0][0], line[1][0]), max(line[0][1], line[1][1]))
+        )
+        for index in self.index.candidates(box):
+            if geom.dist_line_line(line, self.walls[index]) == 0:
                 return True
         
         return False
     
-    def fill_floor(self, num_areas, num_colours):
+    def fill_floor(self, num_areas, num_colours, method='random', seed=None):
         """
         Draw the colours on the floor of the map.
         Inputs:
             num_areas: The number of differently colored areas.
             num_colours: The number of different colours allowed.
+            method: How the areas are grown from their seeds:
+                'random': Fill a random pixel from the todo list in
+                    every step. This is quadratic in the number of
+                    pixels.
+                'frontier': The same random region growing, but in
+                    linear time.
+                'voronoi': Give every pixel the colour of the closest
+                    seed, in one array operation per row.
+                'tiled': The same floor as 'voronoi', but the pixels
+                    are only calculated when they are used, in tiles,
+                    see floors.TiledFloor.
+                The other methods paint a new empty floor of one byte per
+                pixel, so the floor is always replaced, also if it was
+                compressed, tiled, never allocated or filled before.
+            seed: A seed for the random generator, to reproduce a floor.
+                If None, the random module is used.
         """
         
+        rnd = random if seed is None else random.Random(seed)
+        
         # Calculate the boundaries and distances between the different
         # possible colours.
         min_colour = 120
@@ -133,7 +556,7 @@ class Map:
         mult = (max_colour - min_colour) / (num_colours-1)
         
         # Randomly choose the colours the seeds will have.
-        colours = [random.randint(0, num_colours-1) for i in range(num_areas)]
+        colours = [rnd.randint(0, num_colours-1) for i in range(num_areas)]
         colours = list(map(lambda c: int(c*mult) + min_colour, colours))
         
         # Make a todo-list which will contain the location and colour
@@ -141,15 +564,37 @@ class Map:
         # Fill this list with the random locations of the seeds.
         todo = []
         for i in range(num_areas):
-            x = random.randint(0, self.wpix-1)
-            y = random.randint(0, self.hpix-1)
+            x = rnd.randint(0, self.wpix-1)
+            y = rnd.randint(0, self.hpix-1)
             todo.append(((x, y), colours[i]))
         
+        if method == 'tiled':
+            self.floor = TiledFloor(self.wpix, self.hpix, todo)
+        else:
+            # The fill methods only paint empty pixels, in place.
+            self.floor = bytearray(b'\xff') * (self.wpix * self.hpix)
+            if method == 'frontier':
+                self.fill_frontier(todo, rnd)
+            elif method == 'voronoi':
+                self.fill_voronoi(todo)
+            else:
+                self.fill_random(todo, rnd)
+        self.changed()
+    
+    def fill_random(self, todo, rnd):
+        """
+        Grow the floor areas by picking random pixels from the todo list
+        until the entire floor is painted. See self.fill_floor().
+        Inputs:
+            todo: A list with the seeds ((x, y), colour).
+            rnd: The random generator to use.
+        """
+        
         # Keep going untill the entire floor is painted.
         while len(todo):
             
             # Get a random pixel from the todo list.
-            coor, colour = todo.pop(random.randint(0, len(todo)-1))
+            coor, colour = todo.pop(rnd.randint(0, len(todo)-1))
             
             # Put this pixel on the floor if it is empty.
             if self.is_empty(coor):
@@ -164,15 +609,84 @@ class Map:
                         self.is_empty((x, y))):
                     todo.append(((x, y), colour))
     
-    def place_walls(self, num):
+    def fill_frontier(self, todo, rnd):
+        """
+        Grow the floor areas like self.fill_random(), in linear time. A
+        random pixel is removed from the todo list by swapping it with
+        the last one, and pixels that are already painted are skipped
+        instead of growing further. See self.fill_floor().
+        Inputs:
+            todo: A list with the seeds ((x, y), colour).
+            rnd: The random generator to use.
+        """
+        
+        floor = self.floor
+        w = self.wpix
+        n = len(floor)
+        
+        # Work with indices in self.floor instead of coordinates.
+        todo = [(self.wpix*coor[1] + coor[0], colour) for coor, colour in todo]
+        
+        while todo:
+            k = int(rnd.random() * len(todo))
+            todo[k], todo[-1] = todo[-1], todo[k]
+            p, colour = todo.pop()
+            
+            if floor[p] != 255:
+                continue
+            floor[p] = colour
+            
+            # Add the empty neighbours in the same row and column.
+            x = p % w
+            if x > 0 and floor[p-1] == 255:
+                todo.append((p-1, colour))
+            if x < w-1 and floor[p+1] == 255:
+                todo.append((p+1, colour))
+            if p >= w and floor[p-w] == 255:
+                todo.append((p-w, colour))
+            if p+w < n and floor[p+w] == 255:
+                todo.append((p+w, colour))
+    
+    def fill_voronoi(self, seeds):
+        """
+        Give every pixel the colour of the closest seed. Random region
+        growing from all seeds at once grows roughly equally fast in
+        every direction, so this gives similar areas. See
+        self.fill_floor().
+        Inputs:
+            seeds: A list with the seeds ((x, y), colour).
+        """
+        
+        floor = self.floor_array()
+        seed_x = np.array([s[0][0] for s in seeds])
+        seed_y = np.array([s[0][1] for s in seeds])
+        colours = np.array([s[1] for s in seeds], dtype=np.uint8)
+        
+        x = np.arange(self.wpix)
+        for y in range(self.hpix):
+            d = (x[:, np.newaxis] - seed_x)**2 + (y - seed_y)**2
+            floor[y] = colours[d.argmin(axis=1)]
+    
+    def place_walls(self, num, method='analytic'):
         """
         Put walls on the map.
         Inputs:
             num: The number of walls to place.
+            method: How the length of a wall is found:
+                'grow': Grow the wall in steps of 0.1 m until one of
+                    its ends comes closer than 0.07 m per step to
+                    another wall.
+                'analytic': Calculate the step at which 'grow' would
+                    stop directly from the existing walls, see
+                    self.wall_steps(). This gives the same walls.
         """
         
+        # The distance field and scan table no longer match the walls.
+        self.field = None
+        self.scan_table = None
+        
         # Add walls around the map.
-        self.walls.extend([
+        self.add_walls([
             ((0, 0), (self.width, 0)),
             ((self.width, 0), (self.width, self.height)),
             ((self.width, self.height), (0, self.height)),
@@ -197,85 +711,189 @@ class Map:
                     self.closest_wall((x1, y1)) < 1 or
                     self.closest_wall((x2, y2)) < 1
                 )
-                
-            step = 0
-            close = False
-            while not close:
-                step += 1
-                
+            
+            if method == 'analytic':
+                step = self.wall_steps(xc, yc, ang)
                 x1 = xc - 0.1*step * math.cos(ang)
                 y1 = yc - 0.1*step * math.sin(ang)
                 x2 = xc + 0.1*step * math.cos(ang)
                 y2 = yc + 0.1*step * math.sin(ang)
-                
-                close = (
-                    self.closest_wall((x1, y1)) < 0.07*step or
-                    self.closest_wall((x2, y2)) < 0.07*step
-                )
+            else:
+                step = 0
+                close = False
+                while not close:
+                    step += 1
+                    
+                    x1 = xc - 0.1*step * math.cos(ang)
+                    y1 = yc - 0.1*step * math.sin(ang)
+                    x2 = xc + 0.1*step * math.cos(ang)
+                    y2 = yc + 0.1*step * math.sin(ang)
+                    
+                    close = (
+                        self.closest_wall((x1, y1)) < 0.07*step or
+                        self.closest_wall((x2, y2)) < 0.07*step
+                    )
             
-            self.walls.append(((x1, y1), (x2, y2)))
+            self.add_walls([((x1, y1), (x2, y2))])
+    
+    def wall_steps(self, xc, yc, ang):
+        """
+        Calculate the first step at which a wall that grows from a
+        centre in steps of 0.1 m comes too close to another wall: one of
+        its ends is closer than 0.07 m per step to an existing wall.
+        Inputs:
+            xc: The x-coordinate of the centre of the wall.
+            yc: The y-coordinate of the centre of the wall.
+            ang: The orientation of the wall.
+        Output:
+            The number of steps.
+        """
+        
+        # With t = 0.1*step the distance along the wall, an end
+        # c + t*d of the wall is too close if dist(c + t*d, wall) < k*t.
+        # The distance to a wall is the smallest of the distances to its
+        # two end points and to its interior, so we find for each of
+        # these the interval of t in which the end is too close.
+        k = 0.7
+        walls = self.wall_array
+        p1 = walls[:, 0:2]
+        p2 = walls[:, 2:4]
+        v = p2 - p1
+        length = np.hypot(v[:, 0], v[:, 1])
+        w = v / length[:, np.newaxis]
+        n = np.stack((-w[:, 1], w[:, 0]), axis=1)
+        
+        los = []
+        his = []
+        for sign in (-1, 1):
+            d = sign * np.array([math.cos(ang), math.sin(ang)])
+            
+            # The end points: |q + t*d|**2 < k**2 * t**2 with q = c - p
+            # is a quadratic inequality in t.
+            for p in (p1, p2):
+                q = np.array([xc, yc]) - p
+                a = 1 - k**2
+                b = 2 * q.dot(d)
+                c = (q**2).sum(axis=1)
+                disc = b**2 - 4*a*c
+                root = np.sqrt(np.maximum(disc, 0))
+                los.append(np.where(disc > 0, (-b - root) / (2*a), np.inf))
+                his.append(np.where(disc > 0, (-b + root) / (2*a), -np.inf))
+            
+            # The interior: the end must project on the wall, and
+            # |alpha + beta*t| < k*t with alpha + beta*t the signed
+            # distance to the line through the wall.
+            q = np.array([xc, yc]) - p1
+            alpha = (q * n).sum(axis=1)
+            beta = n.dot(d)
+            proj = (q * w).sum(axis=1)
+            proj_d = w.dot(d)
+            lo = np.zeros(len(walls))
+            hi = np.full(len(walls), np.inf)
+            for g, h in [
+                    (beta - k, -alpha),      # alpha + beta*t < k*t
+                    (-beta - k, alpha),      # -(alpha + beta*t) < k*t
+                    (-proj_d, proj),         # proj + proj_d*t >= 0
+                    (proj_d, length - proj)  # proj + proj_d*t <= length
+                    ]:
+                lo, hi = _clip_interval(lo, hi, g, h)
+            los.append(lo)
+            his.append(hi)
+        
+        # Find the first step that lies in one of the intervals.
+        lo = np.maximum(np.concatenate(los), 0)
+        hi = np.concatenate(his)
+        steps = np.floor(lo / 0.1) + 1
+        steps = steps[(lo < hi) & (0.1*steps < hi)]
+        return int(steps.min())
     
     def draw(self, floor=True, walls=True, robot=None, particles=None):
         """
-        Draw the map to an image.
+        Draw the map to an image. The floor and walls are only drawn
+        once and cached, see self.static_layer().
         Inputs:
             floor: A boolean that sets whether the floor will be drawn.
             walls: Id. for the walls.
             robot: A tuple (x, y) that gives the robot location.
-            particles: A list with (x, y)-tuples that give the locations
-                of the particles that must be drawn.
+            particles: A ParticleSet, or a list with (angle, (x, y))
+                tuples, with the particles that must be drawn.
         """
         
-        im = Image.new('RGB', (self.wpix, self.hpix))
+        im = self.static_layer(floor, walls).copy()
         draw = ImageDraw.Draw(im)
         
-        # Draw the floor.
-        if floor:
-            data = [(a, a, a) for a in self.floor]
-            im.putdata(data)
-        
         # Draw the robot as a red 2x2 square.
         if robot is not None:
             x, y = robot
             x1 = int(math.floor(x/self.resolution))
-            y1 = self.hpix - int(math.floor(y/self.resolution)) - 1
+            y1 = self.hpix - int(math.ceil(y/self.resolution)) - 1
             x2 = int(math.ceil(x/self.resolution))
-            y2 = self.hpix - int(math.ceil(y/self.resolution)) - 1
+            y2 = self.hpix - int(math.floor(y/self.resolution)) - 1
             draw.rectangle((x1, y1, x2, y2), fill=(255, 0, 0))
         
-        # Draw the walls as lines.
-        if walls:
-            for wall in self.walls:
-                w = (
-                    self.coor_to_pixel(wall[0]),
-                    self.coor_to_pixel(wall[1])
-                )
-                draw.line(w, fill=0)
-        
-        # Draw the particles as green/yellow points.
+        # Draw the particles as green/yellow points. The colour depends
+        # on the number of particles in a pixel.
         if particles is not None:
-            pixels = {}
-            max_value = 0
+            if isinstance(particles, ParticleSet):
+                x, y = particles.x, particles.y
+            else:
+                x = np.array([p[1][0] for p in particles])
+                y = np.array([p[1][1] for p in particles])
             
-            for particle in particles:
-                p = self.coor_to_pixel(particle[1])
-                if p not in pixels:
-                    pixels[p] = 0
-                pixels[p] += 1
-                
-                if pixels[p] > max_value:
-                    max_value = pixels[p]
+            px, py = self.coors_to_pixels(x, y)
+            inside = (px >= 0) & (px < self.wpix) & (py >= 0) & (py < self.hpix)
+            counts = np.bincount(
+                py[inside] * self.wpix + px[inside],
+                minlength=self.wpix * self.hpix
+            ).reshape(self.hpix, self.wpix)
             
-            for p in pixels:
-                value = int(255 * pixels[p] / max_value)
-                particle = (value, 255, 255-value)
-                base = im.getpixel(p)
+            if counts.any():
+                pixels = counts > 0
+                value = (255 * counts[pixels] // counts.max()).astype(float)
+                particle = np.stack((value, np.full(value.shape, 255), 255 - value), axis=1)
                 
-                colour = tuple([int(0.4*x + 0.6*y) for x,y in zip(base, particle)])
-                im.putpixel(p, colour)
+                data = np.array(im)
+                data[pixels] = (0.4*data[pixels] + 0.6*particle).astype(np.uint8)
+                im = Image.fromarray(data)
         
         return im
     
+    def static_layer(self, floor=True, walls=True):
+        """
+        Get the image with the floor and walls, as drawn by self.draw().
+        The image is built once and cached until self.changed() is
+        called, so it must not be modified.
+        Inputs:
+            floor: A boolean that sets whether the floor will be drawn.
+            walls: Id. for the walls.
+        Output:
+            An RGB Image.
+        """
+        
+        key = (floor, walls)
+        if key not in self.layers:
+            
+            # Draw the floor straight from the floor buffer.
+            if floor:
+                im = Image.frombuffer('L', (self.wpix, self.hpix),
+                    self.floor_array(), 'raw', 'L', 0, 1).convert('RGB')
+            else:
+                im = Image.new('RGB', (self.wpix, self.hpix))
+            
+            # Draw the walls as lines.
+            if walls:
+                draw = ImageDraw.Draw(im)
+                for wall in self.walls:
+                    w = (
+                        self.coor_to_pixel(wall[0]),
+                        self.coor_to_pixel(wall[1])
+                    )
+                    draw.line(w, fill=0)
+            
+            self.layers[key] = im
+        
+        return self.layers[key]
+    
     def save(self, path):
         """
         Save the floor and walls layout to a file that can be read by
@@ -284,20 +902,261 @@ class Map:
             path: The filename.
         """
         
+        # A compressed or tiled floor is stored as it is.
         db = shelve.open(path, 'c')
-        db['floor'] = self.floor
+        if isinstance(self.floor, (RunLengthFloor, TiledFloor)):
+            db['floor'] = self.floor
+        else:
+            db['floor'] = bytes(self.floor)
         db['walls'] = self.walls
+        if self.scan_table is not None:
+            db['scans'] = self.scan_table.state()
         db.close()
     
     def load(self, path):
         """
         Load the floor and walls layout from a file that was created by
-        self.save().
+        self.save() or self.save_binary().
         Inputs:
             path: The filename.
         """
         
+        if is_binary_map(path):
+            self.load_binary(path)
+            return
+        
         db = shelve.open(path, 'r')
         self.floor = db['floor']
+        if not isinstance(self.floor, (RunLengthFloor, TiledFloor)):
+            self.floor = bytearray(self.floor)
+        self.changed()
         self.walls = db['walls']
+        self.update_walls()
+        self.field = None
+        self.scan_table = None
+        if 'scans' in db:
+            self.scan_table = ScanTable(self, 0, 0)
+            self.scan_table.set_state(db['scans'])
         db.close()
+    
+    def save_binary(self, path):
+        """
+        Save the map to a file in the binary map format, see
+        binary_header. Unlike self.save(), this also stores the size
+        and resolution of the map, and the distance field.
+        Inputs:
+            path: The filename.
+        """
+        
+        walls = self.wall_array.astype('<f8').tobytes()
+        offset = binary_header.size + len(walls)
+        offset = -(-offset // binary_alignment) * binary_alignment
+        
+        flags = 0
+        if isinstance(self.floor, RunLengthFloor):
+            flags = binary_compressed
+        elif isinstance(self.floor, TiledFloor):
+            flags = binary_tiled
+        
+        f = open(path, 'wb')
+        f.write(binary_header.pack(
+            binary_magic, binary_version, flags,
+            self.width, self.height, self.resolution,
+            self.wpix, self.hpix, len(self.walls), offset
+        ))
+        f.write(walls)
+        f.write(bytes(offset - f.tell()))
+        if flags == binary_compressed:
+            f.write(binary_runs.pack(len(self.floor.starts)))
+            f.write(self.floor.starts.astype('<i8').tobytes())
+            f.write(self.floor.values.tobytes())
+        elif flags == binary_tiled:
+            f.write(binary_tiles.pack(self.floor.tile_size, len(self.floor.colours)))
+            f.write(self.floor.seed_x.astype('<i8').tobytes())
+            f.write(self.floor.seed_y.astype('<i8').tobytes())
+            f.write(self.floor.colours.tobytes())
+        else:
+            f.write(self.floor)
+        
+        if self.field is not None:
+            ny, nx = self.field.shape
+            data = self.field.astype('<f8').tobytes()
+            f.write(binary_section.pack(b'DFLD', binary_field.size + len(data)))
+            f.write(binary_field.pack(
+                self.field_resolution, self.field_lookup.encode(), ny, nx
+            ))
+            f.write(data)
+        
+        if self.scan_table is not None:
+            table = self.scan_table
+            keys = np.array(list(table.scans), dtype='<i8').reshape(-1, 3).tobytes()
+            scans = np.array(list(table.scans.values()), dtype='<f8').tobytes()
+            f.write(binary_section.pack(
+                b'SCAN', binary_scans.size + len(keys) + len(scans)
+            ))
+            f.write(binary_scans.pack(
+                table.half_measures, table.max_range, table.cell_size,
+                table.angle_bins, len(table.scans)
+            ))
+            f.write(keys)
+            f.write(scans)
+        
+        f.close()
+    
+    def load_binary(self, path, writable=True):
+        """
+        Load a map from a file that was created by self.save_binary().
+        The size and resolution of the map are taken from the file. The
+        floor is memory-mapped instead of read, so it is only loaded
+        when it is used, and processes that open the same file share
+        its memory.
+        Inputs:
+            path: The filename.
+            writable: If True, changes to the floor are private copies
+                of the mapped pages and do not change the file. If
+                False, the floor is read-only. Until the floor is
+                changed, a pickled copy of the map maps the same file,
+                see self.__getstate__(). Compressed and tiled
+                floors (see self.compress_floor() and self.fill_floor())
+                are read, and always read-only.
+        """
+        
+        f = open(path, 'rb')
+        (magic, version, flags, width, height, resolution,
+            wpix, hpix, num_walls, offset) = binary_header.unpack(f.read(binary_header.size))
+        if magic != binary_magic:
+            f.close()
+            raise ValueError(path + ' is not a binary map')
+        if version > binary_version:
+            f.close()
+            raise ValueError(path + ' has unsupported map version ' + str(version))
+        
+        self.width = width
+        self.height = height
+        self.resolution = resolution
+        self.wpix = wpix
+        self.hpix = hpix
+        
+        walls = np.frombuffer(f.read(32 * num_walls), dtype='<f8').reshape(-1, 4)
+        self.walls = [((x1, y1), (x2, y2)) for x1, y1, x2, y2 in walls.tolist()]
+        self.update_walls()
+        
+        # A compressed or tiled floor is small, so it is read instead of
+        # mapped.
+        self.floor_source = None
+        if flags & binary_compressed:
+            f.seek(offset)
+            runs, = binary_runs.unpack(f.read(binary_runs.size))
+            starts = np.frombuffer(f.read(8 * runs), dtype='<i8')
+            values = np.frombuffer(f.read(runs), dtype=np.uint8)
+            self.floor = RunLengthFloor(starts, values, wpix * hpix)
+        elif flags & binary_tiled:
+            f.seek(offset)
+            tile_size, count = binary_tiles.unpack(f.read(binary_tiles.size))
+            seed_x = np.frombuffer(f.read(8 * count), dtype='<i8').tolist()
+            seed_y = np.frombuffer(f.read(8 * count), dtype='<i8').tolist()
+            colours = list(f.read(count))
+            seeds = [((x, y), c) for x, y, c in zip(seed_x, seed_y, colours)]
+            self.floor = TiledFloor(wpix, hpix, seeds, tile_size)
+        else:
+            self.map_floor(path, offset, mmap.ACCESS_COPY if writable else mmap.ACCESS_READ)
+            f.seek(offset + wpix * hpix)
+        self.changed()
+        
+        # Read the optional sections.
+        self.field = None
+        self.scan_table = None
+        header = f.read(binary_section.size)
+        while len(header) == binary_section.size:
+            tag, length = binary_section.unpack(header)
+            data = f.read(length)
+            
+            if tag == b'DFLD':
+                field_resolution, lookup, ny, nx = binary_field.unpack_from(data)
+                self.field_resolution = field_resolution
+                self.field_lookup = lookup.rstrip(b'\0').decode()
+                self.field = np.frombuffer(
+                    data, dtype='<f8', offset=binary_field.size
+                ).reshape(ny, nx).copy()
+                self.field_stats = {'samples': 0, 'total': 0, 'max': 0}
+            
+            elif tag == b'SCAN':
+                half_measures, max_range, cell_size, angle_bins, count = binary_scans.unpack_from(data)
+                keys = np.frombuffer(data, dtype='<i8', count=3*count,
+                    offset=binary_scans.size).reshape(-1, 3)
+                scans = np.frombuffer(data, dtype='<f8',
+                    offset=binary_scans.size + keys.nbytes).reshape(count, 2*half_measures)
+                self.scan_table = ScanTable(self, half_measures, max_range, cell_size, angle_bins)
+                self.scan_table.scans = dict(zip(map(tuple, keys.tolist()), scans.copy()))
+            
+            header = f.read(binary_section.size)
+        
+        f.close()
+    
+    def map_floor(self, path, offset, access):
+        """
+        Memory-map the floor of a binary map file, see
+        self.load_binary().
+        Inputs:
+            path: The filename.
+            offset: The position of the floor in the file.
+            access: mmap.ACCESS_COPY or mmap.ACCESS_READ.
+        """
+        
+        f = open(path, 'rb')
+        self.floor = mmap.mmap(f.fileno(), self.wpix * self.hpix, access=access, offset=offset)
+        f.close()
+        self.floor_source = (os.path.abspath(path), offset)
+
+def is_binary_map(path):
+    """
+    Check if a file is in the binary map format of Map.save_binary().
+    """
+    
+    if not os.path.isfile(path):
+        return False
+    f = open(path, 'rb')
+    magic = f.read(len(binary_magic))
+    f.close()
+    return magic == binary_magic
+
+def open_map(path, writable=False):
+    """
+    Open a map that was saved with Map.save_binary(). By default the
+    floor is read-only, so that the processes that open or unpickle the
+    map share its memory.
+    Inputs:
+        path: The filename.
+        writable: See Map.load_binary().
+    Output:
+        A Map object.
+    """
+    
+    f = open(path, 'rb')
+    header = binary_header.unpack(f.read(binary_header.size))
+    f.close()
+    
+    ma = Map(header[3], header[4], header[5], allocate_floor=False)
+    ma.load_binary(path, writable)
+    return ma
+
+def _clip_interval(lo, hi, g, h):
+    """
+    Intersect intervals (lo, hi) with the solutions of g*t < h.
+    Inputs:
+        lo: An array with the lower bounds of the intervals.
+        hi: An array with the upper bounds of the intervals.
+        g: An array with the factors of t.
+        h: An array with the right hand sides.
+    Output:
+        A tuple (lo, hi) with the new bounds.
+    """
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bound = h / g
+    lo = np.where(g < 0, np.maximum(lo, bound), lo)
+    hi = np.where(g > 0, np.minimum(hi, bound), hi)
+    
+    # If g == 0 the inequality holds for all t or for none.
+    hi = np.where((g == 0) & (h <= 0), -np.inf, hi)
+    return lo, hi
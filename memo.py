@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+
+class LRUCache:
+    
+    def __init__(self, size):
+        """
+        Initialize an empty cache that keeps at most size items, and
+        forgets the least recently used item when it is full.
+        Inputs:
+            size: The maximal number of items.
+        """
+        
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def get(self, key, default=None):
+        """
+        Get an item from the cache, and count the hit or miss.
+        Inputs:
+            key: The key of the item.
+            default: The value to return if the key is not cached.
+        Output:
+            The cached value, or default.
+        """
+        
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key]
+        
+        self.misses += 1
+        return default
+    
+    def put(self, key, value):
+        """
+        Add an item to the cache.
+        """
+        
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+    
+    def stats(self):
+        """
+        Get the usage statistics of the cache.
+        Output:
+            A dictionary with the number of hits and misses, the hit
+            rate and the number of cached items.
+        """
+        
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'size': len(self.items)
+        }
@@ -1,77 +1,206 @@
 #!/usr/bin/env python3
 
+import argparse
+import contextlib
+import json
+import multiprocessing
 import random
 import math
 import os
+import time
+import zlib
+
+import numpy as np
 
 import mapp
 import robot
 import geom
+import results
 
-def test_case(name, iterations, map_size, resolution, num_areas, num_colours, num_walls, num_particles):
+def iteration_seed(name, i):
+    """
+    Get the seed of an iteration of a test case. It only depends on the
+    name of the test case and the iteration, so a single iteration can
+    be reproduced with run_iteration().
+    """
     
-    data = []
+    return zlib.crc32((name + ':' + str(i)).encode())
+
+def run_iteration(name, i, seed, map_size, resolution, num_areas, num_colours, num_walls, num_particles, metrics_path=None, step_times=None):
+    """
+    Do one iteration of a test case: generate a map and move the robots
+    until they have found their own location. If metrics_path is given,
+    the convergence metrics of both robots after every step are written
+    to it as JSON, see robot.Robot.convergence_metrics(). If step_times
+    is a dictionary, the durations of the steps of the robots in
+    seconds are stored in it as lists under 'R1' and 'R2'.
+    Output:
+        A tuple (time1, time2) with the number of steps the robots
+        needed.
+    """
     
-    # Do the test iterations times.
-    for i in range(1, iterations+1):
-        
-        # Generate a map.
-        ma = mapp.Map(map_size, map_size, resolution)
-        ma.fill_floor(num_areas, num_colours)
-        ma.place_walls(num_walls)
-        
-        # Find a good starting point for the robots.
-        r1 = robot.Robot1(ma, num_particles)
-        r2 = robot.Robot2(ma, num_particles)
-        
-        cond = True
-        while cond:
-            x = random.random() * ma.width
-            y = random.random() * ma.height
-            cond = ma.closest_wall((x, y)) < r1.size
+    random.seed(seed)
+    np.random.seed(seed)
+    
+    # Generate a map.
+    ma = mapp.Map(map_size, map_size, resolution)
+    ma.fill_floor(num_areas, num_colours)
+    ma.place_walls(num_walls)
+    
+    # Find a good starting point for the robots.
+    r1 = robot.Robot1(ma, num_particles)
+    r2 = robot.Robot2(ma, num_particles)
+    
+    cond = True
+    while cond:
+        x = random.random() * ma.width
+        y = random.random() * ma.height
+        cond = ma.closest_wall((x, y)) < r1.size
+    
+    ang = random.random() * 2*math.pi
+    r1.put(ang, (x, y))
+    r2.put(ang, (x, y))
+    if metrics_path is not None:
+        r1.metrics = []
+        r2.metrics = []
+    
+    if step_times is None:
+        step_times = {}
+    step_times['R1'] = []
+    step_times['R2'] = []
+    
+    # Move the robots until they have found their own location.
+    time1 = 0
+    time2 = 0
+    j = 0
+    while not (time1 and time2):
+        j += 1
         
-        ang = random.random() * 2*math.pi
-        r1.put(ang, (x, y))
-        r2.put(ang, (x, y))
+        # Find a control so that the robots won't hit a wall.
+        if time1 == 0:
+            start = time.perf_counter()
+            intersect = True
+            while intersect:
+                ang = random.random() * 2*math.pi
+                dist = 1
+                intersect, dest = r1.motion_model((ang, dist))
+            if r1.move(ang, dist):
+                time1 = j
+            step_times['R1'].append(time.perf_counter() - start)
         
-        # Move the robots until they have found their own location.
-        time1 = 0
-        time2 = 0
-        j = 0
-        while not (time1 and time2):
-            j += 1
-            
-            # Find a control so that the robots won't hit a wall.
-            if time1 == 0:
-                intersect = True
-                while intersect:
-                    ang = random.random() * 2*math.pi
-                    dist = 1
-                    intersect, dest = r1.motion_model((ang, dist))
-                if r1.move(ang, dist):
-                    time1 = j
-            
-            if time2 == 0:
-                intersect = True
-                while intersect:
-                    ang = random.random() * 2*math.pi
-                    dist = 1
-                    intersect, dest = r2.motion_model((ang, dist))
-                if r2.move(ang, dist):
-                    time2 = j
+        if time2 == 0:
+            start = time.perf_counter()
+            intersect = True
+            while intersect:
+                ang = random.random() * 2*math.pi
+                dist = 1
+                intersect, dest = r2.motion_model((ang, dist))
+            if r2.move(ang, dist):
+                time2 = j
+            step_times['R2'].append(time.perf_counter() - start)
+    
+    if metrics_path is not None:
+        f = open(metrics_path, 'w')
+        json.dump({'R1': r1.metrics, 'R2': r2.metrics}, f)
+        f.close()
+    
+    return (time1, time2)
+
+def _run_task(task):
+    name, i, seed, params, metrics_path = task
+    step_times = {}
+    data = run_iteration(name, i, seed, *params, metrics_path=metrics_path, step_times=step_times)
+    return {
+        'name': name,
+        'iteration': i,
+        'seed': seed,
+        'config': dict(zip(parameters, params)),
+        'results': {'R1': data[0], 'R2': data[1]},
+        'step_times': step_times
+    }
+
+def read_progress(path):
+    """
+    Read the iterations that were already finished.
+    Output:
+        A dictionary that maps iterations to result tuples.
+    """
+    
+    return {
+        record['iteration']: (record['results']['R1'], record['results']['R2'])
+        for record in results.read_results(path)
+    }
+
+def test_case(name, iterations, map_size, resolution, num_areas, num_colours, num_walls, num_particles, workers=None, metrics=False):
+    """
+    Do iterations iterations of a test case, see test_cases().
+    Output:
+        A list with the (time1, time2) tuples, ordered by iteration.
+    """
+    
+    params = (map_size, resolution, num_areas, num_colours, num_walls, num_particles)
+    return test_cases([(name, params)], iterations, workers, metrics)[name]
+
+def test_cases(cases, iterations, workers=None, metrics=False):
+    """
+    Do iterations iterations of several test cases, spread over one pool
+    of worker processes, so that no worker waits for the last iterations
+    of a test case. Every finished iteration is appended to the results
+    file '<name>.jsonl' of its test case in progress_path, with its
+    seed, parameters and step durations, see results.ResultWriter. An
+    interrupted test case resumes where it stopped. If metrics is True,
+    the convergence metrics of every iteration are written to
+    '<name>-<iteration>.metrics.json' in progress_path.
+    Inputs:
+        cases: A list with (name, parameters) tuples, see
+            configurations().
+    Output:
+        A dictionary that maps the names to lists with the (time1,
+        time2) tuples, ordered by iteration.
+    """
+    
+    os.makedirs(progress_path, exist_ok=True)
+    paths = {}
+    done = {}
+    tasks = []
+    for name, params in cases:
+        paths[name] = os.path.join(progress_path, name+'.jsonl')
+        done[name] = read_progress(paths[name])
+        tasks += [
+            (name, i, iteration_seed(name, i), tuple(params),
+                os.path.join(progress_path, name+'-'+str(i)+'.metrics.json') if metrics else None)
+            for i in range(1, iterations+1) if i not in done[name]
+        ]
+    
+    if tasks:
+        # Write every iteration as soon as it is finished, so that a
+        # resumed test case does not run it again.
+        with contextlib.ExitStack() as stack:
+            writers = {
+                name: stack.enter_context(results.ResultWriter(paths[name], buffer_size=1))
+                for name in {task[0] for task in tasks}
+            }
             
-            print(
-                '\r"'+name+'" iteration '+str(i)+
-                ', time '+str(j)+
-                ', R1: '+str(time1)+
-                ', R2: '+str(time2),
-                end=''
-            )
-        
-        data.append((time1, time2))
-        print('')
+            # The pool is terminated if the test cases are interrupted.
+            pool = stack.enter_context(multiprocessing.Pool(workers))
+            for record in pool.imap_unordered(_run_task, tasks):
+                name = record['name']
+                data = (record['results']['R1'], record['results']['R2'])
+                done[name][record['iteration']] = data
+                writers[name].write(record)
+                print(
+                    '"'+name+'" iteration '+str(record['iteration'])+
+                    ' ('+str(len(done[name]))+'/'+str(iterations)+')'+
+                    ', R1: '+str(data[0])+
+                    ', R2: '+str(data[1])
+                )
+            pool.close()
+            pool.join()
     
-    return data
+    return {
+        name: [done[name][i] for i in range(1, iterations+1)]
+        for name in done
+    }
 
 def output_data(path, data):
     f = open(path, 'w')
@@ -80,6 +209,9 @@ def output_data(path, data):
         f.write(str(d[0])+','+str(d[1])+'\n')
     f.close()
 
+# The names of the parameters of a test case, in order.
+parameters = ['map_size', 'resolution', 'num_areas', 'num_colours', 'num_walls', 'num_particles']
+
 # Test parameters
 size = [20, 15, 25, 30]
 resolution = 0.1
@@ -92,58 +224,56 @@ particles = [100, 70, 140, 200]
 iterations = 30
 
 data_path = 'data/'
+progress_path = 'data/runs/'
 
-test = {
-    'base_case': False,
-    'map_size': False,
-    'num_areas': False,
-    'num_colours': True,
-    'num_walls': True,
-    'num_particles': False
-}
-
-# Test the base case.
-name = 'base_case'
-if test[name]:
-    data = test_case(name, iterations, size[0], resolution, areas[0], colours[0], walls[0], particles[0])
-    output_data(data_path+name, data)
-
-# Variable map size.
-name = 'map_size'
-if test[name]:
-    for i in range(1, len(size)):
-        n = name+str(size[i])
-        data = test_case(n, iterations, size[i], resolution, areas[0], colours[0], walls[0], particles[0])
-        output_data(data_path+n, data)
-
-# Variable number of areas.
-name = 'num_areas'
-if test[name]:
-    for i in range(1, len(areas)):
-        n = name+str(areas[i])
-        data = test_case(n, iterations, size[0], resolution, areas[i], colours[0], walls[0], particles[0])
-        output_data(data_path+n, data)
-
-# Variable number of colours.
-name = 'num_colours'
-if test[name]:
-    for i in range(1, len(colours)):
-        n = name+str(colours[i])
-        data = test_case(n, iterations, size[0], resolution, areas[0], colours[i], walls[0], particles[0])
-        output_data(data_path+n, data)
-
-# Variable number of walls.
-name = 'num_walls'
-if test[name]:
-    for i in range(1, len(walls)):
-        n = name+str(walls[i])
-        data = test_case(n, iterations, size[0], resolution, areas[0], colours[0], walls[i], particles[0])
-        output_data(data_path+n, data)
-
-# Variable number of particles.
-name = 'num_particles'
-if test[name]:
-    for i in range(1, len(particles)):
-        n = name+str(particles[i])
-        data = test_case(n, iterations, size[0], resolution, areas[0], colours[0], walls[0], particles[i])
-        output_data(data_path+n, data)
+def configurations():
+    """
+    Get all test cases, as a dictionary that maps the name of an
+    experiment to a list of (name, parameters) tuples. Every experiment
+    varies one parameter of the base case.
+    """
+    
+    base = [size[0], resolution, areas[0], colours[0], walls[0], particles[0]]
+    tests = {'base_case': [('base_case', base)]}
+    
+    for name, values, index in [
+            ('map_size', size, 0),
+            ('num_areas', areas, 2),
+            ('num_colours', colours, 3),
+            ('num_walls', walls, 4),
+            ('num_particles', particles, 5)
+            ]:
+        tests[name] = []
+        for value in values[1:]:
+            params = list(base)
+            params[index] = value
+            tests[name].append((name+str(value), params))
+    
+    return tests
+
+if __name__ == '__main__':
+    tests = configurations()
+    
+    parser = argparse.ArgumentParser(description='Run the part 1 experiments.')
+    parser.add_argument('tests', nargs='*',
+        help='The experiments to run: ' + ', '.join(tests) + ' (default: all).')
+    parser.add_argument('--workers', type=int, default=None,
+        help='The number of worker processes (default: one per core).')
+    parser.add_argument('--iteration', type=int, default=None,
+        help='Only reproduce this iteration of the test cases.')
+    parser.add_argument('--metrics', action='store_true',
+        help='Log the convergence metrics of every step.')
+    args = parser.parse_args()
+    for test in args.tests:
+        if test not in tests:
+            parser.error('unknown experiment: ' + test)
+    
+    selected = [case for test in args.tests or list(tests) for case in tests[test]]
+    if args.iteration is not None:
+        for name, params in selected:
+            seed = iteration_seed(name, args.iteration)
+            print(name, args.iteration, run_iteration(name, args.iteration, seed, *params))
+    else:
+        data = test_cases(selected, iterations, workers=args.workers, metrics=args.metrics)
+        for name, _ in selected:
+            output_data(data_path+name, data[name])
@@ -4,95 +4,149 @@ import random
 import math
 import os
 import sys
+import time
+
+import numpy as np
 
 import mapp
 import robot
 import geom
+import part1
+import results
 
-def test_case(name, iterations, map_size, resolution, num_areas, num_colours, num_walls, num_particles):
+def test_case(name, iterations, map_size, resolution, num_areas, num_colours, num_walls, num_particles, frame_path=None, results_path=None):
+    """
+    Do iterations iterations of the part 2 test case. If results_path is
+    given, every finished iteration is appended to it with its seed,
+    parameters and step durations, see results.ResultWriter.
+    Output:
+        A list with (time1a, time1b, time2a, time2b) tuples.
+    """
+    
+    params = (map_size, resolution, num_areas, num_colours, num_walls, num_particles)
+    writer = None
+    if results_path is not None:
+        writer = results.ResultWriter(results_path, buffer_size=1)
+    
+    # Make the frame directories, one for every robot.
+    if frame_path is not None:
+        for r in ('r1a', 'r1b', 'r2a', 'r2b'):
+            os.makedirs(frame_path+r, exist_ok=True)
     
     data = []
     
     # Do the test iterations times.
-    for i in range(1, iterations+1):
-        
-        # Generate a map.
-        ma = mapp.Map(map_size, map_size, resolution)
-        ma.fill_floor(num_areas, num_colours)
-        ma.place_walls(num_walls)
-        
-        # Find a good starting point for the robots.
-        r1a = robot.Robot1(ma, num_particles)
-        r1b = robot.Robot1(ma, num_particles)
-        r2a = robot.Robot2(ma, num_particles)
-        r2b = robot.Robot2(ma, num_particles)
-        
-        cond = True
-        while cond:
-            x = random.random() * ma.width
-            y = random.random() * ma.height
-            cond = ma.closest_wall((x, y)) < r1a.size
-        
-        ang = random.random() * 2*math.pi
-        r1a.put(ang, (x, y))
-        r1b.put(ang, (x, y))
-        r2a.put(ang, (x, y))
-        r2b.put(ang, (x, y))
-        
-        # Move the robots until they have found their own location.
-        time1a = 0
-        time1b = 0
-        time2a = 0
-        time2b = 0
-        j = 0
-        
-        #while not (time1a and time1b and time2a and time2b):
-        while time2b < 10:
-            #r1a.draw().save('test_move/r1a/'+str(j)+'.png')
-            #r1b.draw().save('test_move/r1b/'+str(j)+'.png')
-            #r2a.draw().save('test_move/r2a/'+str(j)+'.png')
-            #r2b.draw().save('test_move/r2b/'+str(j)+'.png')
+    try:
+        for i in range(1, iterations+1):
+            seed = part1.iteration_seed(name, i)
+            random.seed(seed)
+            np.random.seed(seed)
+            
+            # Generate a map.
+            ma = mapp.Map(map_size, map_size, resolution)
+            ma.fill_floor(num_areas, num_colours)
+            ma.place_walls(num_walls)
             
-            j += 1
+            # Find a good starting point for the robots.
+            r1a = robot.Robot1(ma, num_particles)
+            r1b = robot.Robot1(ma, num_particles)
+            r2a = robot.Robot2(ma, num_particles)
+            r2b = robot.Robot2(ma, num_particles)
             
-            # Move the random robots:
-            if time1a == 0:
-                ang = random.gauss(0, math.pi/3)
-                dist = 1
-                if r1a.move(ang, dist):
-                    time1a = j
+            cond = True
+            while cond:
+                x = random.random() * ma.width
+                y = random.random() * ma.height
+                cond = ma.closest_wall((x, y)) < r1a.size
             
-            if time2a == 0:
-                ang = random.gauss(0, math.pi/3)
-                dist = 1
-                if r2a.move(ang, dist):
-                    time2a = j
+            ang = random.random() * 2*math.pi
+            r1a.put(ang, (x, y))
+            r1b.put(ang, (x, y))
+            r2a.put(ang, (x, y))
+            r2b.put(ang, (x, y))
             
-            # Move the self controlled robots.
-            if time1b == 0 and r1b.autonome_move():
-                time1b = j
+            # Move the robots until they have found their own location.
+            time1a = 0
+            time1b = 0
+            time2a = 0
+            time2b = 0
+            j = 0
+            step_times = {'R1': [], 'R1 (autonome)': [], 'R2': [], 'R2 (autonome)': []}
             
-            if time2b == 0 and r2b.autonome_move():
-                time2b = j
+            #while not (time1a and time1b and time2a and time2b):
+            while time2b < 10:
+                if frame_path is not None:
+                    r1a.draw().save(frame_path+'r1a/'+str(j)+'.png')
+                    r1b.draw().save(frame_path+'r1b/'+str(j)+'.png')
+                    r2a.draw().save(frame_path+'r2a/'+str(j)+'.png')
+                    r2b.draw().save(frame_path+'r2b/'+str(j)+'.png')
+                
+                j += 1
+                
+                # Move the random robots:
+                if time1a == 0:
+                    start = time.perf_counter()
+                    ang = random.gauss(0, math.pi/3)
+                    dist = 1
+                    if r1a.move(ang, dist):
+                        time1a = j
+                    step_times['R1'].append(time.perf_counter() - start)
+                
+                if time2a == 0:
+                    start = time.perf_counter()
+                    ang = random.gauss(0, math.pi/3)
+                    dist = 1
+                    if r2a.move(ang, dist):
+                        time2a = j
+                    step_times['R2'].append(time.perf_counter() - start)
+                
+                # Move the self controlled robots.
+                if time1b == 0:
+                    start = time.perf_counter()
+                    if r1b.autonome_move():
+                        time1b = j
+                    step_times['R1 (autonome)'].append(time.perf_counter() - start)
+                
+                if time2b == 0:
+                    start = time.perf_counter()
+                    if r2b.autonome_move():
+                        time2b = j
+                    step_times['R2 (autonome)'].append(time.perf_counter() - start)
+                
+                print(
+                    '\r"'+name+'" iteration '+str(i)+
+                    ', time '+str(j)+
+                    ', R1a: '+str(time1a)+
+                    ', R1b: '+str(time1b)+
+                    ', R2a: '+str(time2a)+
+                    ', R2b: '+str(time2b),
+                    end=''
+                )
             
-            print(
-                '\r"'+name+'" iteration '+str(i)+
-                ', time '+str(j)+
-                ', R1a: '+str(time1a)+
-                ', R1b: '+str(time1b)+
-                ', R2a: '+str(time2a)+
-                ', R2b: '+str(time2b),
-                end=''
-            )
-        
-        data.append((time1a, time1b, time2a, time2b))
-        print('')
+            data.append((time1a, time1b, time2a, time2b))
+            print('')
+            
+            if writer is not None:
+                writer.write({
+                    'name': name,
+                    'iteration': i,
+                    'seed': seed,
+                    'config': dict(zip(part1.parameters, params)),
+                    'results': dict(zip(columns, data[-1])),
+                    'step_times': step_times
+                })
+    finally:
+        if writer is not None:
+            writer.close()
     
     return data
 
+# The names of the robots, as used in the results.
+columns = ['R1', 'R1 (autonome)', 'R2', 'R2 (autonome)']
+
 def output_data(path, data):
     f = open(path, 'w')
-    f.write('R1,R1 (autonome),R2,R2 (autonome)\n')
+    f.write(','.join(columns)+'\n')
     for d in data:
         line = ''
         for time in d:
@@ -111,5 +165,12 @@ walls = 10
 particles = 100
 iterations = 1
 
-data = test_case('part2', iterations, size, resolution, areas, colours, walls, particles)
+# Directory for the frames of every step, or None to skip them.
+frame_path = 'test_move/'
+
+# File to which every iteration is appended, or None.
+results_path = 'data/runs/part2.jsonl'
+
+os.makedirs(os.path.dirname(results_path), exist_ok=True)
+data = test_case('part2', iterations, size, resolution, areas, colours, walls, particles, frame_path, results_path)
 output_data('data/part2', data)
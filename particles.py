@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class ParticleSet:
+    
+    def __init__(self, ang, x, y, weight):
+        """
+        Initialize a set of particles, stored as one array per field.
+        Inputs:
+            ang: An array with the orientations of the particles in
+                radians.
+            x: An array with the x-coordinates of the particles.
+            y: An array with the y-coordinates of the particles.
+            weight: An array with the weights of the particles.
+        """
+        
+        self.ang = np.asarray(ang, dtype=float)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.weight = np.asarray(weight, dtype=float)
+    
+    def __len__(self):
+        return len(self.ang)
+    
+    def __iter__(self):
+        """
+        Iterate over the particles as tuples ((ang, (x, y)), weight),
+        which is the format the particles had before they were stored
+        in arrays.
+        """
+        
+        for ang, x, y, w in zip(self.ang.tolist(), self.x.tolist(),
+                self.y.tolist(), self.weight.tolist()):
+            yield ((ang, (x, y)), w)
+    
+    def __getitem__(self, index):
+        """
+        Get a particle as a tuple ((ang, (x, y)), weight), or a list of
+        such tuples if index is a slice.
+        """
+        
+        if isinstance(index, slice):
+            return list(self.take(np.arange(len(self))[index]))
+        
+        return (
+            (float(self.ang[index]), (float(self.x[index]), float(self.y[index]))),
+            float(self.weight[index])
+        )
+    
+    def states(self):
+        """
+        Get the states of the particles.
+        Output:
+            A list with tuples (ang, (x, y)).
+        """
+        
+        return [p[0] for p in self]
+    
+    def pose(self):
+        """
+        Get the arrays with the poses of the particles.
+        Output:
+            A tuple (ang, x, y).
+        """
+        
+        return (self.ang, self.x, self.y)
+    
+    def take(self, indices):
+        """
+        Select a subset of the particles.
+        Inputs:
+            indices: An array with the indices of the particles to
+                select. Indices may be repeated.
+        Output:
+            A new ParticleSet.
+        """
+        
+        indices = np.asarray(indices, dtype=int)
+        return ParticleSet(
+            self.ang[indices],
+            self.x[indices],
+            self.y[indices],
+            self.weight[indices]
+        )
+    
+    def extend(self, other):
+        """
+        Join two particle sets.
+        Inputs:
+            other: Another ParticleSet.
+        Output:
+            A new ParticleSet that contains the particles of both sets.
+        """
+        
+        return ParticleSet(
+            np.concatenate((self.ang, other.ang)),
+            np.concatenate((self.x, other.x)),
+            np.concatenate((self.y, other.y)),
+            np.concatenate((self.weight, other.weight))
+        )
+
+def resample_multinomial(weights, num):
+    """
+    Draw num independent samples from the weight distribution, using a
+    binary search in the cumulative weights.
+    Inputs:
+        weights: An array with the (unnormalized) particle weights.
+        num: The number of samples to draw.
+    Output:
+        An array with the indices of the selected particles.
+    """
+    
+    cumulative = np.cumsum(weights)
+    selectors = np.random.random(num) * cumulative[-1]
+    return _search(cumulative, selectors)
+
+def resample_systematic(weights, num):
+    """
+    Low variance resampling (Thrun p. 110): one random offset and num
+    equally spaced selectors.
+    Inputs:
+        weights: An array with the (unnormalized) particle weights.
+        num: The number of samples to draw.
+    Output:
+        An array with the indices of the selected particles.
+    """
+    
+    cumulative = np.cumsum(weights)
+    selectors = (np.random.random() + np.arange(num)) / num * cumulative[-1]
+    return _search(cumulative, selectors)
+
+def resample_stratified(weights, num):
+    """
+    Stratified resampling: one random selector in each of num equally
+    sized strata.
+    Inputs:
+        weights: An array with the (unnormalized) particle weights.
+        num: The number of samples to draw.
+    Output:
+        An array with the indices of the selected particles.
+    """
+    
+    cumulative = np.cumsum(weights)
+    selectors = (np.random.random(num) + np.arange(num)) / num * cumulative[-1]
+    return _search(cumulative, selectors)
+
+def resample_residual(weights, num):
+    """
+    Residual resampling: every particle is first copied floor(num * w)
+    times, the remaining samples are drawn multinomially from what is
+    left of the weights.
+    Inputs:
+        weights: An array with the (unnormalized) particle weights.
+        num: The number of samples to draw.
+    Output:
+        An array with the indices of the selected particles.
+    """
+    
+    scaled = num * weights / weights.sum()
+    copies = np.floor(scaled).astype(int)
+    indices = np.repeat(np.arange(len(weights)), copies)
+    
+    rest = num - len(indices)
+    if rest > 0:
+        indices = np.concatenate((
+            indices,
+            resample_multinomial(scaled - copies, rest)
+        ))
+    
+    return indices
+
+def _search(cumulative, selectors):
+    """
+    Find for every selector the first particle whose cumulative weight
+    is not smaller than the selector.
+    """
+    
+    indices = np.searchsorted(cumulative, selectors)
+    return np.minimum(indices, len(cumulative)-1)
+
+resamplers = {
+    'multinomial': resample_multinomial,
+    'systematic': resample_systematic,
+    'stratified': resample_stratified,
+    'residual': resample_residual
+}
@@ -2,28 +2,18 @@
 
 import matplotlib.pyplot as plt
 
-def string_to_list(string):
-    return [int(i) for i in string.split(',')]
+import resultstore
 
-def get_data(path):
-    f = open(path)
-    f.readline()
-    data = []
-    for line in f:
-        data.append(string_to_list(line))
-    data = list(zip(*data))
-    subtract = 3
-    means = [sum(sorted(d)[:len(d)-subtract]) / (len(d)-subtract) for d in data]
+def get_data(store, name):
+    """
+    Get the results and trimmed means of a test case from the results
+    store, with one entry per robot in legends.
+    """
+    
+    data = [store.values(name, robot) for robot in legends]
+    means = [store.aggregate(name, robot)['trimmed_mean'] for robot in legends]
     return data, means
 
-values = {
-    'map_size': [20, 15, 25, 30],
-    'num_areas': [100, 70, 150],
-    'num_colours': [8, 5, 12],
-    'num_walls': [10, 7, 15],
-    'num_particles': [100, 70, 140, 200]
-}
-names = ['map_size', 'num_areas', 'num_colours', 'num_walls', 'num_particles']
 names = ['map_size', 'num_areas', 'num_colours', 'num_walls', 'num_particles']
 
 folder = 'data/'
@@ -31,8 +21,12 @@ legends = ['R1', 'R2']
 colors = ['b', 'r']
 plot_number = 1
 
+store = resultstore.ResultStore(folder+'results.sqlite')
+store.ingest_folder(folder)
+base = store.config('base_case')
+
 plt.subplot(2, 3, plot_number)
-data, base_means = get_data(folder+'base_case')
+data, base_means = get_data(store, 'base_case')
 for i in range(len(data)):
     plt.plot(
         [i+1 for k in range(len(data[i]))],
@@ -61,22 +55,21 @@ plt.legend(loc='upper left')
 plt.title('base_case')
 
 for name in names:
-    data = [base_means]
     
-    for i in range(1, len(values[name])):
-        value = values[name][i]
-        _, means = get_data(folder+name+str(value))
-        if value < values[name][0]:
-            data.insert(0, means)
-        else:
-            data.append(means)
-    data = list(zip(*data))
+    # Take the parameter values from the test cases in the store.
+    values = [base[name]]
+    data = [base_means]
+    for case in store.names(name):
+        values.append(store.config(case)[name])
+        data.append(get_data(store, case)[1])
+    order = sorted(range(len(values)), key=lambda k: values[k])
+    data = list(zip(*[data[k] for k in order]))
     
     plot_number += 1
     plt.subplot(2, 3, plot_number)
     for i in range(len(data)):
         plt.plot(
-            sorted(values[name]),
+            sorted(values),
             data[i],
             color=colors[i],
             marker='+'
@@ -84,4 +77,5 @@ for name in names:
     plt.ylim((0, 200))
     plt.title(name)
 
+store.close()
 plt.show()
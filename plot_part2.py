@@ -2,24 +2,16 @@
 
 import matplotlib.pyplot as plt
 
-def string_to_list(string):
-    return [int(i) for i in string.split(',')]
-
-def get_data(path):
-    f = open(path)
-    f.readline()
-    data = []
-    for line in f:
-        data.append(string_to_list(line))
-    data = list(zip(*data))
-    subtract = 3
-    means = [sum(sorted(d)[:len(d)-subtract]) / (len(d)-subtract) for d in data]
-    return data, means
+import resultstore
 
 folder = 'data/'
-names = ['R1', 'R1 (autonome)', 'R2', 'R2 (autonome)']
 colors = ['b', 'r', 'g', 'y']
-data, means = get_data(folder+'part2')
+
+store = resultstore.ResultStore(folder+'results.sqlite')
+store.ingest_folder(folder)
+names = store.robots('part2')
+data = [store.values('part2', robot) for robot in names]
+means = [store.aggregate('part2', robot)['trimmed_mean'] for robot in names]
 for i in range(len(data)):
     plt.plot(
         [i+1 for k in range(len(data[i]))],
@@ -46,4 +38,5 @@ plt.tick_params(
 )
 plt.legend(loc='upper left')
 plt.title('part 2')
+store.close()
 plt.show()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+
+import geom
+
+# The functions of the geom module whose calls are counted.
+kernels = [
+    'dist_line_line',
+    'dist_point_line',
+    'dist_points',
+    'intersect_lines',
+    'dist_points_lines',
+    'cast_rays',
+    'sweep_circle_line',
+    'sweep_circles_lines'
+]
+
+class Profiler:
+    
+    def __init__(self, memory=False):
+        """
+        Initialize a profiler that records, per named phase, the time,
+        the number of calls, the number of calls of the geom kernels and
+        the peak memory use. Phases can be nested: the time and memory
+        of a phase include those of its inner phases, kernel calls are
+        only counted for the innermost phase.
+        
+        Usage:
+            profiler = Profiler()
+            rob.profiler = profiler
+            with profiler:
+                rob.move(ang, dist)
+            profiler.stats()
+        
+        Kernel calls in the worker processes of the planner (see
+        robot.Robot1.planner_workers) are not counted.
+        Inputs:
+            memory: A boolean that sets whether the peak memory use is
+                recorded with tracemalloc. This slows everything down
+                considerably.
+        """
+        
+        self.memory = memory
+        
+        # The totals per phase, and the totals per phase of every step
+        # finished with self.step().
+        self.phases = {}
+        self.steps = []
+        self.current_step = {}
+        
+        # The stack of open phases, as lists [name, start time, start
+        # memory, peak memory].
+        self.stack = []
+        self.originals = None
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.stop()
+    
+    def start(self):
+        """
+        Start counting the geom kernels, and tracing the memory if
+        self.memory is True.
+        """
+        
+        if self.originals is None:
+            self.originals = {}
+            for name in kernels:
+                self.originals[name] = getattr(geom, name)
+                setattr(geom, name, self.counter(name, self.originals[name]))
+        
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def stop(self):
+        """
+        Restore the geom kernels and stop tracing the memory.
+        """
+        
+        if self.originals is not None:
+            for name, function in self.originals.items():
+                setattr(geom, name, function)
+            self.originals = None
+        
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+    
+    def counter(self, name, function):
+        """
+        Wrap a geom kernel so that its calls are counted for the
+        innermost open phase.
+        """
+        
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            if self.stack:
+                phase = self.stack[-1][0]
+                for totals in (self.phases, self.current_step):
+                    kernel_counts = entry(totals, phase)['kernels']
+                    kernel_counts[name] = kernel_counts.get(name, 0) + 1
+            return function(*args, **kwargs)
+        return counted
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Record a phase, for use in a with statement.
+        Inputs:
+            name: The name of the phase.
+        """
+        
+        # Memory peaks are measured from the start of the phase, so the
+        # peak of the outer phase so far is saved before resetting.
+        memory = self.memory and tracemalloc.is_tracing()
+        current = 0
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+            tracemalloc.reset_peak()
+        
+        frame = [name, time.perf_counter(), current, current]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            self.stack.pop()
+            
+            peak = 0
+            if memory:
+                frame[3] = max(frame[3], tracemalloc.get_traced_memory()[1])
+                peak = frame[3] - frame[2]
+                if self.stack:
+                    self.stack[-1][3] = max(self.stack[-1][3], frame[3])
+            
+            for totals in (self.phases, self.current_step):
+                e = entry(totals, name)
+                e['time'] += elapsed
+                e['calls'] += 1
+                e['peak_memory'] = max(e['peak_memory'], peak)
+    
+    def step(self):
+        """
+        Finish a step: store the totals per phase since the previous
+        step in self.steps.
+        """
+        
+        self.steps.append(self.current_step)
+        self.current_step = {}
+    
+    def stats(self):
+        """
+        Get the totals per phase.
+        Output:
+            A dictionary that maps phase names to dictionaries with the
+            cumulative 'time' in seconds, the number of 'calls', the
+            number of calls per geom kernel in 'kernels' and the
+            'peak_memory' in bytes (0 if memory is not traced).
+        """
+        
+        return self.phases
+    
+    def dump(self, path):
+        """
+        Write the totals and the totals of every step to a JSON file.
+        """
+        
+        f = open(path, 'w')
+        json.dump({'phases': self.phases, 'steps': self.steps}, f, indent=1)
+        f.close()
+
+def entry(totals, name):
+    """
+    Get the totals of a phase, and add them if they do not exist yet.
+    """
+    
+    if name not in totals:
+        totals[name] = {'time': 0, 'calls': 0, 'kernels': {}, 'peak_memory': 0}
+    return totals[name]
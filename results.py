@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+import time
+
+class ResultWriter:
+    
+    def __init__(self, path, buffer_size=10, flush_interval=10):
+        """
+        Initialize a writer that appends results to a file as JSON
+        lines, one record per line. Records are buffered, and the buffer
+        is written by self.write() when it holds buffer_size records, or
+        when its oldest record is flush_interval seconds old. The age is
+        only checked on a write, so use buffer_size=1 if every record
+        must be on disk as soon as it is written. The buffer is also
+        written by self.close(), so use the writer in a with statement
+        to keep the buffered records when a run is interrupted. Only
+        whole lines are written, so the file can be read with
+        read_results() while the run is going on.
+        Inputs:
+            path: The file to append to.
+            buffer_size: The maximal number of buffered records.
+            flush_interval: The maximal age of a buffered record in
+                seconds.
+        """
+        
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        
+        self.file = open(path, 'a')
+        self.buffer = []
+        self.buffered_since = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def write(self, record):
+        """
+        Add a record.
+        Inputs:
+            record: A dictionary that can be converted to JSON.
+        """
+        
+        if not self.buffer:
+            self.buffered_since = time.monotonic()
+        self.buffer.append(json.dumps(record) + '\n')
+        
+        if (len(self.buffer) >= self.buffer_size or
+                time.monotonic() - self.buffered_since >= self.flush_interval):
+            self.flush()
+    
+    def flush(self):
+        """
+        Write all buffered records to the file.
+        """
+        
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.file.flush()
+            self.buffer = []
+    
+    def close(self):
+        """
+        Write the buffered records and close the file.
+        """
+        
+        self.flush()
+        self.file.close()
+
+def read_results(path):
+    """
+    Read the records of a results file of ResultWriter. A missing file
+    has no records. An unfinished last line, of a run that is still
+    going on, is skipped.
+    Output:
+        A list with the records.
+    """
+    
+    records = []
+    try:
+        f = open(path)
+    except FileNotFoundError:
+        return records
+    
+    for line in f:
+        if not line.endswith('\n'):
+            break
+        records.append(json.loads(line))
+    f.close()
+    
+    return records
+
+def write_csv(path, records, columns):
+    """
+    Write the results of records to a CSV file in the format of the
+    files in data/, ordered by iteration.
+    Inputs:
+        path: The CSV file.
+        records: A list with records, see read_results().
+        columns: A list with the keys of the 'results' of the records
+            that become the columns.
+    """
+    
+    f = open(path, 'w')
+    f.write(','.join(columns) + '\n')
+    for record in sorted(records, key=lambda r: r['iteration']):
+        f.write(','.join(str(record['results'][c]) for c in columns) + '\n')
+    f.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print('Usage: results.py results_file csv_file column...')
+        sys.exit(1)
+    
+    write_csv(sys.argv[2], read_results(sys.argv[1]), sys.argv[3:])
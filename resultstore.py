@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+
+import numpy as np
+
+import part1
+import results
+
+schema = '''
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    source TEXT,
+    experiment TEXT,
+    name TEXT,
+    iteration INTEGER,
+    seed INTEGER,
+    map_size NUMERIC,
+    resolution NUMERIC,
+    num_areas INTEGER,
+    num_colours INTEGER,
+    num_walls INTEGER,
+    num_particles INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    run INTEGER,
+    robot TEXT,
+    steps INTEGER
+);
+CREATE TABLE IF NOT EXISTS aggregates (
+    name TEXT,
+    robot TEXT,
+    trim INTEGER,
+    count INTEGER,
+    trimmed_mean REAL,
+    p10 REAL,
+    p25 REAL,
+    p50 REAL,
+    p75 REAL,
+    p90 REAL,
+    ci_low REAL,
+    ci_high REAL,
+    PRIMARY KEY (name, robot, trim)
+);
+CREATE INDEX IF NOT EXISTS runs_experiment ON runs (experiment);
+CREATE INDEX IF NOT EXISTS runs_name ON runs (name);
+CREATE INDEX IF NOT EXISTS runs_source ON runs (source);
+CREATE INDEX IF NOT EXISTS runs_parameters ON runs (
+    map_size, resolution, num_areas, num_colours, num_walls, num_particles
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run);
+'''
+
+class ResultStore:
+    
+    bootstrap_samples = 1000 # Number of resamples for the confidence
+    confidence = 0.95        # intervals of the trimmed mean.
+    
+    def __init__(self, path='data/results.sqlite', trim=3):
+        """
+        Open a store with the results of the experiments, kept in an
+        SQLite file. Results are added with self.ingest_folder(), the
+        aggregates per test case and robot are calculated once and kept
+        in the file until new results for the test case are added.
+        Inputs:
+            path: The SQLite file.
+            trim: The number of highest results of a test case that are
+                left out of the trimmed mean.
+        """
+        
+        self.trim = trim
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+        
+        # Map the names of the part 1 test cases to their experiment
+        # and parameters, for the CSV files that only contain results.
+        self.known = {}
+        for experiment, cases in part1.configurations().items():
+            for name, params in cases:
+                self.known[name] = (experiment, dict(zip(part1.parameters, params)))
+    
+    def close(self):
+        self.db.close()
+    
+    def ingest_folder(self, folder='data/'):
+        """
+        Add the CSV files in folder and the results files in
+        folder/runs/. A CSV file is skipped if there is a results file
+        for the same test case, since it was made from the same runs.
+        Files that did not change since they were added are skipped.
+        """
+        
+        runs = os.path.join(folder, 'runs')
+        streamed = set()
+        if os.path.isdir(runs):
+            for filename in sorted(os.listdir(runs)):
+                if filename.endswith('.jsonl'):
+                    self.ingest(os.path.join(runs, filename), self.ingest_results)
+                    streamed.add(filename[:-len('.jsonl')])
+        
+        # Drop the results of a CSV file that was added before there was
+        # a results file for its test case.
+        for filename in sorted(os.listdir(folder)):
+            path = os.path.join(folder, filename)
+            if os.path.isfile(path) and '.' not in filename:
+                if filename in streamed:
+                    self.forget(path)
+                else:
+                    self.ingest(path, self.ingest_csv)
+        
+        self.db.commit()
+    
+    def ingest(self, path, read):
+        """
+        Replace the results of a file if it changed since it was added.
+        Inputs:
+            path: The file.
+            read: self.ingest_csv or self.ingest_results.
+        """
+        
+        stat = os.stat(path)
+        row = self.db.execute('SELECT mtime, size FROM sources WHERE path = ?', (path,)).fetchone()
+        if row == (stat.st_mtime, stat.st_size):
+            return
+        
+        self.forget(path)
+        names = read(path)
+        self.db.executemany('DELETE FROM aggregates WHERE name = ?', [(n,) for n in set(names)])
+        self.db.execute('INSERT INTO sources VALUES (?, ?, ?)',
+            (path, stat.st_mtime, stat.st_size))
+    
+    def forget(self, path):
+        """
+        Remove the results of a file, and the aggregates of its test
+        cases.
+        """
+        
+        names = [r[0] for r in self.db.execute(
+            'SELECT DISTINCT name FROM runs WHERE source = ?', (path,))]
+        self.db.execute('DELETE FROM results WHERE run IN (SELECT id FROM runs WHERE source = ?)', (path,))
+        self.db.execute('DELETE FROM runs WHERE source = ?', (path,))
+        self.db.executemany('DELETE FROM aggregates WHERE name = ?', [(n,) for n in names])
+        self.db.execute('DELETE FROM sources WHERE path = ?', (path,))
+    
+    def ingest_csv(self, path):
+        """
+        Add a CSV file in the format of the files in data/. The name of
+        the test case is the filename. Rows are numbered as iterations.
+        Output:
+            A list with the name of the test case.
+        """
+        
+        name = os.path.basename(path)
+        experiment, config = self.known.get(name, (name, {}))
+        
+        f = open(path)
+        robots = f.readline().strip().split(',')
+        for i, line in enumerate(f, 1):
+            if line.strip():
+                steps = [int(v) for v in line.split(',')]
+                self.add_run(path, experiment, name, i, None, config, dict(zip(robots, steps)))
+        f.close()
+        
+        return [name]
+    
+    def ingest_results(self, path):
+        """
+        Add a results file of results.ResultWriter.
+        Output:
+            A list with the names of the test cases in the file.
+        """
+        
+        names = set()
+        for record in results.read_results(path):
+            name = record['name']
+            experiment = self.known.get(name, (name, {}))[0]
+            self.add_run(path, experiment, name, record['iteration'],
+                record['seed'], record['config'], record['results'])
+            names.add(name)
+        
+        return list(names)
+    
+    def add_run(self, source, experiment, name, iteration, seed, config, steps):
+        run = self.db.execute(
+            'INSERT INTO runs (source, experiment, name, iteration, seed, ' +
+            ', '.join(part1.parameters) + ') VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [source, experiment, name, iteration, seed] + [config.get(p) for p in part1.parameters]
+        ).lastrowid
+        self.db.executemany('INSERT INTO results VALUES (?, ?, ?)',
+            [(run, robot, s) for robot, s in steps.items()])
+    
+    def names(self, experiment):
+        """
+        Get the test cases of an experiment.
+        Output:
+            A sorted list with names.
+        """
+        
+        return [r[0] for r in self.db.execute(
+            'SELECT DISTINCT name FROM runs WHERE experiment = ? ORDER BY name', (experiment,))]
+    
+    def config(self, name):
+        """
+        Get the parameters of a test case.
+        Output:
+            A dictionary that maps the names of part1.parameters to
+            their values, which are None if they are unknown.
+        """
+        
+        row = self.db.execute(
+            'SELECT ' + ', '.join(part1.parameters) + ' FROM runs WHERE name = ? LIMIT 1', (name,)
+        ).fetchone()
+        return dict(zip(part1.parameters, row or [None] * len(part1.parameters)))
+    
+    def robots(self, name):
+        """
+        Get the robots that have results for a test case, in the order of
+        the files they came from.
+        """
+        
+        return [r[0] for r in self.db.execute(
+            'SELECT robot FROM results JOIN runs ON run = id WHERE name = ? ' +
+            'GROUP BY robot ORDER BY MIN(results.rowid)', (name,))]
+    
+    def values(self, name, robot):
+        """
+        Get all results of a robot in a test case.
+        Output:
+            A list with the number of steps per run, ordered by
+            iteration.
+        """
+        
+        return [r[0] for r in self.db.execute(
+            'SELECT steps FROM results JOIN runs ON run = id ' +
+            'WHERE name = ? AND robot = ? ORDER BY iteration', (name, robot))]
+    
+    def aggregate(self, name, robot):
+        """
+        Get the aggregates of the results of a robot in a test case.
+        They are calculated once and stored.
+        Output:
+            A dictionary with the 'count', the 'trimmed_mean' without the
+            self.trim highest results, the percentiles 'p10', 'p25',
+            'p50', 'p75' and 'p90', and the bootstrap confidence
+            interval ('ci_low', 'ci_high') of the trimmed mean.
+        """
+        
+        columns = ['count', 'trimmed_mean', 'p10', 'p25', 'p50', 'p75', 'p90', 'ci_low', 'ci_high']
+        row = self.db.execute(
+            'SELECT ' + ', '.join(columns) + ' FROM aggregates WHERE name = ? AND robot = ? AND trim = ?',
+            (name, robot, self.trim)
+        ).fetchone()
+        
+        if row is None:
+            values = np.array(self.values(name, robot), dtype=float)
+            if len(values) == 0:
+                raise KeyError((name, robot))
+            
+            # Resample the results with a fixed seed, so that the
+            # intervals do not change between calls.
+            rng = np.random.default_rng(0)
+            samples = rng.choice(values, (self.bootstrap_samples, len(values)))
+            means = trimmed_means(samples, self.trim)
+            alpha = (1 - self.confidence) / 2
+            
+            row = (
+                len(values),
+                float(trimmed_means(values[np.newaxis], self.trim)[0]),
+                *np.percentile(values, [10, 25, 50, 75, 90]).tolist(),
+                float(np.quantile(means, alpha)),
+                float(np.quantile(means, 1 - alpha))
+            )
+            self.db.execute('INSERT INTO aggregates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, robot, self.trim) + row)
+            self.db.commit()
+        
+        return dict(zip(columns, row))
+
+def trimmed_means(samples, trim):
+    """
+    Calculate the means of rows without their trim highest values. All
+    values are used if a row has no more than trim values.
+    Inputs:
+        samples: An array of shape (N, n).
+        trim: The number of highest values to leave out.
+    Output:
+        An array with N means.
+    """
+    
+    n = samples.shape[1]
+    if n <= trim:
+        return samples.mean(axis=1)
+    return np.sort(samples, axis=1)[:, :n-trim].mean(axis=1)
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import contextlib
+import copy
 import math
 import random
+import statistics
+import time
+
+import numpy as np
 
 import mapp
 import geom
+from particles import ParticleSet, resamplers
+from memo import LRUCache
+
+# The context manager of Robot.phase() without a profiler.
+_no_phase = contextlib.nullcontext()
 
 class Robot:
     
@@ -31,14 +43,49 @@ class Robot:
         self.alp_dist = 0.3
         self.w_dist = 10
         
+        # KLD-sampling (Fox 2003, Thrun p. 264). If adaptive is True,
+        # self.move() draws as many particles as needed to keep the
+        # error of the particle approximation below kld_epsilon with
+        # probability 1-kld_delta, bounded by min_particles and
+        # max_particles. Particles are counted in bins of
+        # kld_bin = (meters, meters, radians).
+        self.adaptive = False
+        self.min_particles = num_particles//2
+        self.max_particles = max(10*num_particles, 1000)
+        self.kld_epsilon = 0.05
+        self.kld_delta = 0.01
+        self.kld_bin = (0.5, 0.5, math.pi/9)
+        
+        # The number of particles after every step of self.move().
+        self.particle_counts = []
+        
+        # If metrics is a list, self.move() appends the result of
+        # self.convergence_metrics() to it after every step.
+        self.metrics = None
+        self.cluster_size = 0.5
+        
+        # Optional caches for the exact motions and measurements of the
+        # autonomous planner, see self.use_plan_cache().
+        self.plan_cache = None
+        self.plan_quantum = 0.01
+        
+        # Optional profiling.Profiler that records the time spent in
+        # the phases of self.move() and self.autonome_move().
+        self.profiler = None
+        
+        # The resampling strategy used by self.move(), one of the keys
+        # of particles.resamplers: 'multinomial', 'systematic',
+        # 'stratified' or 'residual'.
+        self.resampling = 'multinomial'
+        
         self.num_particles = num_particles
-        self.particles = []
         
         self.mapp = mapp
         
-        # Draw num_particles random particles inside the map.
-        for i in range(self.num_particles):
-            self.particles.append((self.random_particle(), 0))
+        # Draw num_particles random particles inside the map. The
+        # particles are stored in a ParticleSet, which can be iterated
+        # as a list of tuples ((ang, (x, y)), weight).
+        self.particles = self.random_particles(self.num_particles)
     
     def random_particle(self):
         close = True
@@ -49,6 +96,29 @@ class Robot:
         ang = random.random() * 2*math.pi
         return (ang, (x, y))
     
+    def random_particles(self, num):
+        """
+        Draw random particles inside the map, away from the walls.
+        Inputs:
+            num: The number of particles to draw.
+        Output:
+            A ParticleSet with num particles of weight 0.
+        """
+        
+        x = np.empty(num)
+        y = np.empty(num)
+        
+        # Keep redrawing the particles that are too close to a wall.
+        todo = np.arange(num)
+        while len(todo):
+            x[todo] = np.random.random(len(todo)) * self.mapp.width
+            y[todo] = np.random.random(len(todo)) * self.mapp.height
+            d = geom.dist_points_lines(x[todo], y[todo], self.mapp.wall_array)
+            todo = todo[d.min(axis=1, initial=float('inf')) < self.size]
+        
+        ang = np.random.random(num) * 2*math.pi
+        return ParticleSet(ang, x, y, np.zeros(num))
+    
     def put(self, ang, coor):
         """
         Put the robot on a place on the map.
@@ -113,27 +183,27 @@ class Robot:
         x_step = dist / steps * math.cos(ang)
         y_step = dist / steps * math.sin(ang)
         
-        # Take small steps until the destination is reached, or the
-        # robot collides with a wall.
-        step = 0
-        intersect = False
-        while step < steps and not intersect:
-            
-            # Calculate the position after an incremented number of
-            # steps.
-            step += 1
-            position = (
-                coor[0] + step * x_step,
-                coor[1] + step * y_step
-            )
-            
-            # Check if the robot collides with any of the walls. If so,
-            # make sure we exit the while-loop.
-            for wall in self.mapp.walls:
-                if self.intersects(position, wall):
-                    intersect = True
-                    step -= 1
-                    break
+        # Only the walls near the path of the robot can be hit.
+        x_end = coor[0] + dist * math.cos(ang)
+        y_end = coor[1] + dist * math.sin(ang)
+        box = (
+            (min(coor[0], x_end) - self.size, min(coor[1], y_end) - self.size),
+            (max(coor[0], x_end) + self.size, max(coor[1], y_end) + self.size)
+        )
+        walls = [self.mapp.walls[i] for i in self.mapp.index.candidates(box)]
+        
+        # Find where the robot, a disc that sweeps along its path, first
+        # touches a wall. It stops at the last step of 0.1 before that.
+        t = min(
+            [geom.sweep_circle_line(coor, (x_end, y_end), self.size, wall)
+                for wall in walls],
+            default=float('inf')
+        )
+        intersect = t <= 1
+        if intersect:
+            step = max(int(math.ceil(t * steps)) - 1, 0)
+        else:
+            step = steps
         
         # Calculate the final position of the robot and return this.
         x = coor[0] + step * x_step
@@ -141,6 +211,68 @@ class Robot:
         
         return (intersect, (ang, (x, y)))
     
+    def motion_model_batch(self, u, particles, exact=False):
+        """
+        Calculate the next state of all particles at once. This does the
+        same as self.motion_model() for every particle.
+        Inputs:
+            u: A tuple of the form (angle, distance) describing the
+                desired movement.
+            particles: A ParticleSet with the current states.
+            exact: A boolean describing wether or not to incorporate
+                noise in the movement.
+        Output:
+            A tuple (intersect, particles) where intersect is a boolean
+            array that is True for the particles that hit a wall, and
+            particles is a new ParticleSet with the same weights.
+        """
+        
+        n = len(particles)
+        
+        # Calculate the angle and distance under which to move.
+        if exact:
+            ang = particles.ang + u[0]
+            dist = np.full(n, float(u[1]))
+        else:
+            ang = particles.ang + np.random.normal(u[0], self.a_sigma, n)
+            dist = np.random.normal(u[1], abs(u[1]) * self.d_sigma, n)
+        ang = np.fmod(ang, 2*math.pi)
+        
+        # Calculate a step size of at most 0.1 for every particle.
+        steps = np.maximum(np.ceil(dist / 0.1), 1).astype(int)
+        x_step = dist / steps * np.cos(ang)
+        y_step = dist / steps * np.sin(ang)
+        
+        # If no particle moves further than a cell of the wall index,
+        # only the walls in the 3x3 cells around each particle can be
+        # hit. Otherwise test all walls.
+        if np.abs(dist).max(initial=0) + self.size <= self.mapp.index.cell_size:
+            walls, valid = self.mapp.index.near_walls(particles.x, particles.y)
+        else:
+            walls, valid = self.mapp.wall_array, None
+        
+        # Find where every particle first touches a wall when it sweeps
+        # along its path. A particle stops at its last step before that,
+        # or when it has reached its destination.
+        vx = steps * x_step
+        vy = steps * y_step
+        t = geom.sweep_circles_lines(particles.x, particles.y, vx, vy, self.size, walls)
+        if valid is not None:
+            t = np.where(valid, t, float('inf'))
+        t = t.min(axis=1, initial=float('inf'))
+        
+        intersect = t <= 1
+        step = np.where(
+            intersect,
+            np.maximum(np.ceil(t * steps) - 1, 0),
+            steps
+        ).astype(int)
+        
+        x = particles.x + step * x_step
+        y = particles.y + step * y_step
+        
+        return (intersect, ParticleSet(ang, x, y, particles.weight))
+    
     def move(self, ang, dist, exact=False):
         """
         Move the robot according to the motion model and update the
@@ -156,48 +288,220 @@ class Robot:
         u = (ang, dist)
         
         # Move the robot.
-        _, new_state = self.motion_model(u, exact=exact)
-        self.ang, self.coor = new_state
-        self.measurement = self.measure()
-        
-        # Initialize the temporary particle list with a dummy particle.
-        # Elements are of the form ((ang, (x, y)), weight)
-        temp = [((0, (0, 0)), 0)]
-        for particle in self.particles:
-            _, new_part = self.motion_model(u, particle[0])
-            weight = self.measurement_model(new_part, particle[1])
-            
-            temp.append((new_part, temp[-1][1] + weight, weight))
+        with self.phase('motion'):
+            _, new_state = self.motion_model(u, exact=exact)
+            self.ang, self.coor = new_state
+        with self.phase('measure'):
+            self.measurement = self.measure()
         
-        # Remove the dummy particle and empty the particle list.
-        temp.pop(0)
-        self.particles = []
-        rand_particles = []
-        total_weight = temp[-1][1]
-        self.set_weights(temp)
+        # Move all particles at once, and weigh them according to the
+        # new measurement.
+        with self.phase('particle_motion'):
+            _, moved = self.motion_model_batch(u, self.particles)
+        with self.phase('weigh'):
+            weights = self.weigh(moved)
+            moved.weight = weights
+        with self.phase('set_weights'):
+            self.set_weights(weights)
         
-        # Add num_particles new particles to the list, according to the
-        # cumulative distribution stored in temp[i][1].
-        
-        for i in range(self.num_particles):
-            if random.random() < self.w_random:
-                rand_particles.append((self.random_particle(), 0))
+        # Replace a fraction w_random of the particles by random ones,
+        # and resample the others according to their weights. If all
+        # weights are 0, every particle is equally likely.
+        with self.phase('resample'):
+            w_random = min(max(self.w_random, 0), 1)
+            if weights.sum() <= 0:
+                weights = np.ones(len(weights))
+            resample = resamplers[self.resampling]
+            if self.adaptive:
+                selected = self.kld_resample(moved, weights)
+                num_random = np.random.binomial(len(selected), w_random)
+                selected = selected[:len(selected) - num_random]
             else:
-                selector = random.random() * total_weight
-                
-                # Find the largest temporary particle whose cumulative
-                # weight is smaller than the random selector.
-                k = 0
-                while temp[k][1] < selector:
-                    k += 1
-                self.particles.append((temp[k][0], temp[k][2]))
+                num_random = np.random.binomial(self.num_particles, w_random)
+                selected = resample(weights, self.num_particles - num_random)
+            self.particles = moved.take(selected)
         
         # See if the non-random particles are close enough yet.
-        self.w_dist += self.alp_dist * (self.particles_distance() - self.w_dist)
-        self.particles.extend(rand_particles)
+        with self.phase('convergence'):
+            self.w_dist += self.alp_dist * (self.particles_distance() - self.w_dist)
+            self.particles = self.particles.extend(self.random_particles(num_random))
+            self.particle_counts.append(len(self.particles))
+            if self.metrics is not None:
+                self.metrics.append(self.convergence_metrics())
+        
+        if self.profiler is not None:
+            self.profiler.step()
         
         return self.w_dist < 0.5
     
+    def phase(self, name):
+        """
+        Get a context manager that records a phase in self.profiler, or
+        does nothing if there is no profiler.
+        """
+        
+        if self.profiler is None:
+            return _no_phase
+        return self.profiler.phase(name)
+    
+    def kld_resample(self, particles, weights):
+        """
+        Resample particles with KLD-sampling: draw particles until their
+        number is large enough for the number of bins they occupy.
+        Inputs:
+            particles: A ParticleSet with the moved particles.
+            weights: An array with their weights.
+        Output:
+            An array with the indices of the selected particles.
+        """
+        
+        # Draw the largest allowed number of particles in a random
+        # order, and find how many bins the first n of them occupy.
+        resample = resamplers[self.resampling]
+        selected = np.random.permutation(resample(weights, self.max_particles))
+        bins = np.stack((
+            np.floor(particles.x[selected] / self.kld_bin[0]),
+            np.floor(particles.y[selected] / self.kld_bin[1]),
+            np.floor(np.mod(particles.ang[selected], 2*math.pi) / self.kld_bin[2])
+        ), axis=1)
+        _, first = np.unique(bins, axis=0, return_index=True)
+        new_bin = np.zeros(len(selected), dtype=bool)
+        new_bin[first] = True
+        k = np.cumsum(new_bin)
+        
+        # The number of particles needed for k bins, see Thrun p. 264.
+        z = statistics.NormalDist().inv_cdf(1 - self.kld_delta)
+        a = 2 / (9 * np.maximum(k-1, 1))
+        needed = (k-1) / (2*self.kld_epsilon) * (1 - a + np.sqrt(a) * z)**3
+        needed = np.maximum(needed, self.min_particles)
+        
+        # Stop at the first n for which enough particles are drawn.
+        enough = np.arange(1, len(selected)+1) >= needed
+        n = np.argmax(enough) + 1 if enough.any() else len(selected)
+        return selected[:n]
+    
+    def weigh(self, particles):
+        """
+        Calculate the new weights of all particles with
+        self.measurement_model().
+        Inputs:
+            particles: A ParticleSet with the moved particles and their
+                old weights.
+        Output:
+            An array with the new weights.
+        """
+        
+        return np.array([
+            self.measurement_model(state, weight)
+            for state, weight in particles
+        ])
+    
+    def use_plan_cache(self, size=100000, quantum=0.01):
+        """
+        Cache the exact motions and measurements of the autonomous
+        planner. Sibling branches and deeper levels of the planner often
+        reach almost the same poses, so poses are rounded to a multiple
+        of quantum before they are looked up. A larger quantum gives
+        more hits, but less exact planning.
+        Inputs:
+            size: The maximal number of items in each cache.
+            quantum: The rounding step for coordinates in meters and
+                for angles in radians.
+        """
+        
+        self.plan_cache = {
+            'motion': LRUCache(size),
+            'measurement': LRUCache(size)
+        }
+        self.plan_quantum = quantum
+    
+    def plan_cache_stats(self):
+        """
+        Get the hit rates of the planner caches.
+        Output:
+            A dictionary with the statistics of the 'motion' and
+            'measurement' caches, see memo.LRUCache.stats(), or None if
+            there are no caches.
+        """
+        
+        if self.plan_cache is None:
+            return None
+        return {name: cache.stats() for name, cache in self.plan_cache.items()}
+    
+    def plan_motion(self, u, particles):
+        """
+        Move particles exactly, for the autonomous planner. Uses the
+        motion cache if there is one.
+        Inputs:
+            u: A tuple (angle, distance).
+            particles: A ParticleSet.
+        Output:
+            A ParticleSet with the new poses.
+        """
+        
+        if self.plan_cache is None:
+            return self.motion_model_batch(u, particles, exact=True)[1]
+        
+        q = self.plan_quantum
+        keys = list(zip(
+            np.round(particles.ang / q).astype(int).tolist(),
+            np.round(particles.x / q).astype(int).tolist(),
+            np.round(particles.y / q).astype(int).tolist()
+        ))
+        keys = [k + tuple(u) for k in keys]
+        return self._cached(
+            self.plan_cache['motion'], keys, particles,
+            lambda p: np.stack(self.motion_model_batch(u, p, exact=True)[1].pose(), axis=1),
+            lambda values: ParticleSet(values[:, 0], values[:, 1], values[:, 2], particles.weight)
+        )
+    
+    def plan_measure(self, particles):
+        """
+        Measure exactly at the positions of particles, for the
+        autonomous planner. Uses the measurement cache if there is one.
+        Inputs:
+            particles: A ParticleSet.
+        Output:
+            An array with one measurement per particle, see
+            self.exact_measurements().
+        """
+        
+        if self.plan_cache is None:
+            return self.exact_measurements(particles)
+        
+        q = self.plan_quantum
+        keys = list(zip(
+            np.round(particles.x / q).astype(int).tolist(),
+            np.round(particles.y / q).astype(int).tolist()
+        ))
+        return self._cached(
+            self.plan_cache['measurement'], keys, particles,
+            self.exact_measurements,
+            lambda values: values
+        )
+    
+    def _cached(self, cache, keys, particles, calculate, convert):
+        """
+        Look up the values for keys in cache, and calculate the missing
+        ones for the corresponding particles in one batch.
+        """
+        
+        values = [cache.get(k) for k in keys]
+        
+        # Calculate every missing key only once.
+        missing = {}
+        for i, v in enumerate(values):
+            if v is None and keys[i] not in missing:
+                missing[keys[i]] = i
+        if missing:
+            new_values = calculate(particles.take(list(missing.values())))
+            new_values = dict(zip(missing, new_values))
+            for k, v in new_values.items():
+                cache.put(k, v)
+            values = [new_values[k] if v is None else v for k, v in zip(keys, values)]
+        
+        return convert(np.array(values))
+    
     def particles_distance(self):
         """
         Calculate the average distance of the best portion of the
@@ -205,9 +509,80 @@ class Robot:
         """
         
         avg_num = len(self.particles)//3
-        distances = []
-        distances = [geom.dist_points(self.coor, p[0][1]) for p in self.particles]
-        return sum(sorted(distances)[:avg_num])/avg_num
+        if avg_num == 0:
+            return float('inf')
+        
+        distances = np.hypot(
+            self.particles.x - self.coor[0],
+            self.particles.y - self.coor[1]
+        )
+        
+        # Only the avg_num smallest distances are needed, not the
+        # complete sorted list.
+        return np.partition(distances, avg_num-1)[:avg_num].sum()/avg_num
+    
+    def convergence_metrics(self):
+        """
+        Calculate how well the particles have converged, in linear time.
+        Output:
+            A dictionary with:
+                particles: The number of particles.
+                distance: The result of self.particles_distance().
+                spread: The root mean square distance of the particles
+                    to their mean position.
+                covariance: The covariance matrix of the particle
+                    positions, as a nested list [[xx, xy], [yx, yy]].
+                clusters: The number of connected groups of occupied
+                    cells of cluster_size meters.
+        """
+        
+        x = self.particles.x
+        y = self.particles.y
+        if len(x) < 2:
+            cov = np.zeros((2, 2))
+        else:
+            cov = np.cov(x, y)
+        
+        return {
+            'particles': len(x),
+            'distance': float(self.particles_distance()),
+            'spread': float(math.sqrt(cov[0, 0] + cov[1, 1])),
+            'covariance': cov.tolist(),
+            'clusters': self.count_clusters()
+        }
+    
+    def count_clusters(self):
+        """
+        Count the groups of particles: the connected components of the
+        cells of cluster_size meters that hold at least one particle.
+        Output:
+            The number of clusters.
+        """
+        
+        nx = int(math.ceil(self.mapp.width / self.cluster_size)) + 1
+        ny = int(math.ceil(self.mapp.height / self.cluster_size)) + 1
+        i = np.clip((self.particles.x / self.cluster_size).astype(int), 0, nx-1)
+        j = np.clip((self.particles.y / self.cluster_size).astype(int), 0, ny-1)
+        occupied = np.zeros((nx, ny), dtype=bool)
+        occupied[i, j] = True
+        
+        # Flood fill every cluster from an occupied cell that has not
+        # been visited yet. Diagonal neighbours are connected.
+        clusters = 0
+        todo = set(zip(*np.nonzero(occupied)))
+        while todo:
+            clusters += 1
+            stack = [todo.pop()]
+            while stack:
+                ci, cj = stack.pop()
+                for di in (-1, 0, 1):
+                    for dj in (-1, 0, 1):
+                        cell = (ci+di, cj+dj)
+                        if cell in todo:
+                            todo.remove(cell)
+                            stack.append(cell)
+        
+        return clusters
     
     def print(self):
         """
@@ -227,7 +602,7 @@ class Robot:
         
         return self.mapp.draw(
             robot=self.coor,
-            particles=[p[0] for p in self.particles]
+            particles=self.particles
         )
 
 
@@ -238,21 +613,35 @@ class Robot1(Robot):
     min_range = -10   # The minimal and
     max_range = 10  # maximal measuring distance.
     hit_sigma = 0.3 # See Thrun p. 172.
+    log_weights = False # Normalize the weights in log space, see
+                        # self.weigh().
+    plan_angles = [i/5 * math.pi for i in range(-2, 3)] # Angles examined
+                                                        # by the planner.
+    planner_workers = 0 # Number of processes for the planner, see
+                        # self.expand_states().
+    planning_time = None # Time budget for self.autonome_move() in
+                         # seconds, or None.
+    planner_pool = None
     
     def __init(self, mapp, num_particles):
         self.measurement = []
         super(Robot, self).__init__(mapp, num_particles)
     
-    def set_weights(self, particles):
+    def set_weights(self, weights):
         """
         Update the moving averages used to determine the number of
         random particles that will be drawn.
         Inputs:
-            particles: A list with the temporary particles:
-                (coordinate, cumulative weight, weight).
+            weights: An array with the weights of the moved particles.
         """
         
-        w_max = max([p[2]**(1/len(self.measurement)) for p in particles])
+        # The weights are the product of len(self.measurement) beam
+        # probabilities. Use the geometric mean per beam of the best
+        # particle.
+        if self.log_weights:
+            w_max = math.exp(self.log_likelihood.max() / len(self.measurement))
+        else:
+            w_max = (weights**(1/len(self.measurement))).max()
         
         self.w_slow += self.alp_slow * (w_max - self.w_slow)
         self.w_fast += self.alp_fast * (w_max - self.w_fast)
@@ -280,60 +669,71 @@ class Robot1(Robot):
             ang = state[0]
             coor = state[1]
         
-        measurement = []
+        distances = self.scan([coor[0]], [coor[1]], ang, exact)[0].tolist()
+        thetas = [math.pi * i / self.half_measures for i in range(self.half_measures)]
         
-        # Do range_resolution measurements angles with uniform
-        # differences.
+        measurement = []
         for i in range(self.half_measures):
-            theta = math.pi * i / self.half_measures
-            if exact:
-                real_angle = ang + theta
-            else:
-                real_angle = random.gauss(ang + theta, self.a_sigma)
-            beam = (
-                coor, (
-                    coor[0] + math.cos(real_angle),
-                    coor[1] + math.sin(real_angle)
-                )
-            )
-            
-            # Loop through all the walls, and see if the beam hits them.
-            # Do this in both positive and negative direction, so that
-            # at the end of the loop we have the distances to the
-            # closest wall on either side of the robot.
-            pos_dist = self.max_range
-            neg_dist = -self.max_range
-            for wall in self.mapp.walls:
-                
-                # Find the parameters for which the beam and the wall
-                # intersect.
-                t1, t2 = geom.intersect_lines(beam, wall)
-                
-                # If t2 lies between 0 and 1, the beam hits the wall
-                # at a distance equal to t1.
-                if t2 >= 0 and t2 <= 1:
-                    if t1 > 0 and t1 < pos_dist:
-                        pos_dist = t1
-                    elif t1 < 0 and t1 > neg_dist:
-                        neg_dist = t1
-            
-            # Add a noised version of both measurements to the list if
-            # they are valid.
-            if not exact:
-                pos_dist += random.gauss(0, self.d_sigma * pos_dist)
-                neg_dist += random.gauss(0, self.d_sigma * neg_dist)
-            
-            measurement.append((
-                theta,
-                min(self.max_range, pos_dist)
-            ))
-            measurement.append((
-                theta - math.pi,
-                min(self.max_range, -neg_dist)
-            ))
+            measurement.append((thetas[i], distances[2*i]))
+            measurement.append((thetas[i] - math.pi, distances[2*i+1]))
         
         return measurement
     
+    def scan(self, x, y, ang, exact=False, table=True):
+        """
+        Do range scans around many locations at once, by casting all
+        beams against the packed wall array in one array operation.
+        Exact scans are interpolated from the scan table of the map if
+        it has one, see mapp.Map.use_scan_table().
+        Inputs:
+            x: An array with the x-coordinates of the locations.
+            y: An array with the y-coordinates of the locations.
+            ang: The orientation of the robot, either a number or an
+                array with one orientation per location.
+            exact: A boolean describing wether or not to incorporate
+                noise in the measurements.
+            table: If False, the scan table of the map is not used.
+        Output:
+            An array of shape (len(x), 2*half_measures) with the
+            distances, in the same order as the measurements returned
+            by self.measure().
+        """
+        
+        # Exact scans can be looked up in the scan table of the map, for
+        # the orientations that the table holds. The others are cast.
+        table = self.mapp.scan_table if table else None
+        if exact and table is not None and table.matches(self.half_measures, self.max_range):
+            x = np.asarray(x, dtype=float)
+            y = np.asarray(y, dtype=float)
+            ang = np.broadcast_to(np.asarray(ang, dtype=float), x.shape)
+            valid = table.bins(ang)[2]
+            if valid.all():
+                return table.lookup(x, y, ang)
+            
+            distances = np.empty((len(x), 2*self.half_measures))
+            if valid.any():
+                distances[valid] = table.lookup(x[valid], y[valid], ang[valid])
+            rest = ~valid
+            distances[rest] = self.scan(x[rest], y[rest], ang[rest], exact=True, table=False)
+            return distances
+        
+        # Do half_measures beams under uniformly spaced angles. Every
+        # beam measures in both its positive and negative direction.
+        thetas = math.pi * np.arange(self.half_measures) / self.half_measures
+        angles = np.reshape(ang, (-1, 1)) + thetas
+        if not exact:
+            angles = angles + np.random.normal(0, self.a_sigma, (len(x), len(thetas)))
+        
+        pos, neg = geom.cast_rays(x, y, angles, self.mapp.wall_array, self.max_range)
+        
+        # Add noise to both measurements.
+        if not exact:
+            pos = pos + np.random.normal(0, 1, pos.shape) * self.d_sigma * pos
+            neg = neg + np.random.normal(0, 1, neg.shape) * self.d_sigma * neg
+        
+        distances = np.stack((pos, -neg), axis=-1).reshape(len(pos), -1)
+        return np.minimum(distances, self.max_range)
+    
     def measurement_model(self, particle, old_weight):
         """
         Calculate the probability of a measurement at a location of the
@@ -366,6 +766,62 @@ class Robot1(Robot):
         
         return new_weight
     
+    def weigh(self, particles):
+        """
+        Calculate the new weights of all particles at once. All beams of
+        all particles are scored in one array operation, in log space.
+        If self.log_weights is True, the weights are normalized with the
+        log-sum-exp trick so that they cannot underflow, otherwise they
+        are the same products as calculated by self.measurement_model().
+        Inputs:
+            particles: A ParticleSet with the moved particles.
+        Output:
+            An array with the new weights.
+        """
+        
+        self.log_likelihood = self.measurement_log_likelihood(particles)
+        
+        if self.log_weights:
+            weights = np.exp(self.log_likelihood - self.log_likelihood.max())
+            return weights / weights.sum()
+        else:
+            return np.exp(self.log_likelihood)
+    
+    def measurement_log_likelihood(self, particles):
+        """
+        Calculate the logarithm of the probability of the measurement
+        for many particles at once, see self.measurement_model().
+        Inputs:
+            particles: A ParticleSet.
+        Output:
+            An array with the log-likelihood of every particle.
+        """
+        
+        # Only the beams that hit something are used.
+        meas = np.array(self.measurement).reshape(-1, 2)
+        meas = meas[meas[:, 1] != self.max_range]
+        
+        angles = particles.ang[:, np.newaxis] + meas[:, 0]
+        x = particles.x[:, np.newaxis] + meas[:, 1] * np.cos(angles)
+        y = particles.y[:, np.newaxis] + meas[:, 1] * np.sin(angles)
+        d = self.mapp.closest_walls(x, y)
+        
+        w = np.exp(-d**2 / (2*self.hit_sigma**2)) / (self.hit_sigma*math.sqrt(2*math.pi)) + 0.01
+        return np.log(w).sum(axis=1)
+    
+    def exact_measurements(self, particles):
+        """
+        Do exact scans at the positions of particles, with orientation
+        0, for the autonomous planner.
+        Inputs:
+            particles: A ParticleSet.
+        Output:
+            An array of shape (len(particles), 2*half_measures), see
+            self.scan().
+        """
+        
+        return self.scan(particles.x, particles.y, 0, exact=True)
+    
     def autonome_move(self):
         """
         Find out an optimal direction to move in, and perform the move.
@@ -374,44 +830,160 @@ class Robot1(Robot):
             enough.
         """
         
-        # Only use the 10% of the particles with the highest weight.
-        particles = sorted(self.particles, key=lambda p: p[1], reverse=True)
-        particles = [p[0] for p in particles[:5]]
-        
-        measurements = []
-        for p in particles:
-            state = (0, p[1])
-            measurements.append(self.measure(state=state, exact=True))
-        
-        # Create a root state with empty angles list and usability
-        # factor 0. States always contain
-        #   - A list with angles in which to rotate and move in order
-        #     to reach the state.
-        #   - The usability factor of the state.
-        #   - A list of particles that must be used to find the best
-        #     directions. Particles are of the form (angle, (x, y)).
-        states = [([], 0, particles)]
-        depth = 5
-        
-        # Go depth steps deep to find the best direction under which to
-        # move the robot.
-        for i in range(depth):
-            # Only preserve the 3 best states to speed up calculations.
-            states = states[:2]
-            new_states = []
+        with self.phase('plan'):
+            # Only use the 5 particles with the highest weight.
+            order = np.argsort(-self.particles.weight, kind='stable')
+            particles = self.particles.take(order[:5])
+            
+            # Do an exact scan at every root particle, all at once.
+            measurements = self.plan_measure(particles)
+            
+            # Create a root state with empty angles list and usability
+            # factor 0. States always contain
+            #   - A list with angles in which to rotate and move in order
+            #     to reach the state.
+            #   - The usability factor of the state.
+            #   - A ParticleSet with the particles that must be used to
+            #     find the best directions.
+            states = [([], 0, particles)]
+            depth = 5
             
-            # Calculate all the children states for the preserved
-            # states and add them to a new list of states. Sort the list
-            # based on the usability factor.
-            for state in states:
-                new_states.extend(self.new_states(state, measurements))
-            states = sorted(new_states, key=lambda s: s[1], reverse=True)
+            # Go depth steps deep to find the best direction under which to
+            # move the robot. When the time budget is used up, stop and use
+            # the best state found so far. The first level is always
+            # completed, so that there is a direction to move in.
+            deadline = None
+            if self.planning_time is not None:
+                deadline = time.perf_counter() + self.planning_time
+            
+            for i in range(depth):
+                # Only preserve the 2 best states to speed up calculations.
+                states = states[:2]
+                
+                # Calculate all the children states for the preserved
+                # states. Sort the list based on the usability factor.
+                new_states = self.expand_states(states, measurements, deadline if i else None)
+                if not new_states:
+                    break
+                states = sorted(new_states, key=lambda s: s[1], reverse=True)
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
         
         # Take the best angle (the one with the highest factor) from the
         # list and perform the actual move.
         angle = states[0][0][0]
         return self.move(angle, 1)
     
+    def expand_states(self, states, measurements, deadline=None):
+        """
+        This function is used by self.autonome_move(). Calculate the
+        children of states for all angles in self.plan_angles. If
+        self.planner_workers is larger than 0, the branches are
+        evaluated in a pool of worker processes that each hold a copy of
+        the map.
+        Inputs:
+            states: A list with states, see self.autonome_move().
+            measurements: An array with the exact measurements of the
+                root particles.
+            deadline: A time from time.perf_counter() after which no
+                more branches are started, or None. A branch that was
+                started before it is finished, so the deadline can be
+                exceeded by the time of one branch.
+        Output:
+            A list with the children states that were started before
+            the deadline, in the order of states and angles.
+        """
+        
+        branches = [(state, angle) for state in states for angle in self.plan_angles]
+        results = []
+        
+        if self.planner_workers:
+            # Only submit a branch when a worker is free, so that no
+            # branch is queued at the deadline. Running branches can not
+            # be stopped, so they are finished and kept.
+            pool = self.get_planner_pool()
+            running = {}
+            finished = {}
+            submitted = 0
+            while submitted < len(branches) or running:
+                while (len(running) < self.planner_workers and
+                        submitted < len(branches) and
+                        (deadline is None or time.perf_counter() < deadline)):
+                    state, angle = branches[submitted]
+                    future = pool.submit(_evaluate_branch, state[2], angle, measurements)
+                    running[future] = submitted
+                    submitted += 1
+                if not running:
+                    break
+                
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    finished[running.pop(future)] = future.result()
+            
+            results = [(branches[i], finished[i]) for i in sorted(finished)]
+        else:
+            for state, angle in branches:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                results.append((
+                    (state, angle),
+                    self.evaluate_branch(state[2], angle, measurements)
+                ))
+        
+        return [
+            (state[0]+[angle], state[1]+factor, new_particles)
+            for (state, angle), (new_particles, factor) in results
+        ]
+    
+    def get_planner_pool(self):
+        """
+        Get the pool of worker processes for the planner, and start it
+        if necessary. Every worker gets a copy of the planner, see
+        self.planner_copy().
+        """
+        
+        if self.planner_pool is None:
+            self.planner_pool = concurrent.futures.ProcessPoolExecutor(
+                self.planner_workers,
+                initializer=_init_planner,
+                initargs=(self.planner_copy(),)
+            )
+        return self.planner_pool
+    
+    def planner_copy(self):
+        """
+        Copy the robot for the worker processes of the planner, with the
+        same map and settings, so that branches are evaluated as in
+        self.expand_states() without workers. The particles, the pool,
+        the profiler and the metrics are left out, and the planner
+        caches (see self.use_plan_cache()) are replaced by empty caches
+        of the same size.
+        Output:
+            A Robot1.
+        """
+        
+        planner = copy.copy(self)
+        planner.particles = None
+        planner.planner_pool = None
+        planner.profiler = None
+        planner.metrics = None
+        planner.particle_counts = []
+        if self.plan_cache is not None:
+            planner.plan_cache = {
+                name: LRUCache(cache.size) for name, cache in self.plan_cache.items()
+            }
+        return planner
+    
+    def close_planner(self):
+        """
+        Stop the worker processes of the planner.
+        """
+        
+        if self.planner_pool is not None:
+            self.planner_pool.shutdown()
+            self.planner_pool = None
+    
     def new_states(self, state, measurements):
         """
         This function is used by self.autonome_move(). Given a set of
@@ -420,48 +992,50 @@ class Robot1(Robot):
         Inputs:
             state: A tuple describing the state. See 
                 self.autonome_move() for a full explanation.
-            measurements: A list with the measurements of the root
-                particles from self.autonome_move().
+            measurements: An array with the exact scans of the root
+                particles from self.autonome_move(), see
+                self.exact_measurements().
         Output:
             A list of new state similar to the input.
         """
         
-        angles = [i/5 * math.pi for i in range(-2, 3)]
-        fav = {}
-        particles = state[2]
-        new_states = []
+        return self.expand_states([state], measurements)
+    
+    def evaluate_branch(self, particles, angle, measurements):
+        """
+        Calculate the next pose for all particles. Measure at the new
+        pose and calculate the difference of this measurement with the
+        measurement of the corresponding root particle. A higher
+        difference is better.
+        Inputs:
+            particles: A ParticleSet.
+            angle: The angle under which to move.
+            measurements: An array with the exact scans of the root
+                particles.
+        Output:
+            A tuple (new_particles, factor).
+        """
         
-        # Loop through the list of angles that must be examined.
-        for angle in angles:
-            u = (angle, 1)
-            new_particles = []
-            
-            # Calculate the next pose for all particles. Measure at the
-            # new pose and calculate the difference of this measurement
-            # with the measurement of the corresponding root particle.
-            # A higher difference is better.
-            factor = 0
-            for i in range(len(particles)):
-                _, new_part = self.motion_model(u, particles[i], exact=True)
-                new_particles.append(new_part)
-                new_state = (0, new_part[1])
-                measurement = self.measure(state=new_state, exact=True)
-                
-                avg_diff = 0
-                for m in range(2*self.half_measures):
-                    meas = measurements[i][m][1]
-                    avg_diff += abs(meas - measurement[m][1])
-                avg_diff /= 2*self.half_measures
-                factor += avg_diff / len(particles)
-            
-            # Add a state to the list of new states.
-            new_states.append((
-                state[0]+[angle],
-                state[1]+factor,
-                new_particles
-            ))
+        u = (angle, 1)
+        new_particles = self.plan_motion(u, particles)
+        measurement = self.plan_measure(new_particles)
         
-        return new_states
+        avg_diff = np.abs(measurements - measurement).mean(axis=1)
+        factor = avg_diff.sum() / len(particles)
+        
+        return (new_particles, factor)
+
+
+# The robot used by the planner in a worker process, see
+# Robot1.get_planner_pool().
+_planner = None
+
+def _init_planner(planner):
+    global _planner
+    _planner = planner
+
+def _evaluate_branch(particles, angle, measurements):
+    return _planner.evaluate_branch(particles, angle, measurements)
 
 
 class Robot2(Robot):
@@ -470,16 +1044,15 @@ class Robot2(Robot):
         self.measurement = 0
         super(Robot, self).__init__(mapp, num_particles)
     
-    def set_weights(self, particles):
+    def set_weights(self, weights):
         """
         Update the moving averages used to determine the number of
         random particles that will be drawn.
         Inputs:
-            particles: A list with the temporary particles: 
-                (coordinate, cumulative weight, weight).
+            weights: An array with the weights of the moved particles.
         """
         
-        w_avg = sum([p[2] for p in particles]) / self.num_particles
+        w_avg = weights.sum() / len(weights)
         
         self.w_slow += self.alp_slow * (w_avg - self.w_slow)
         self.w_fast += self.alp_fast * (w_avg - self.w_fast)
@@ -518,6 +1091,34 @@ class Robot2(Robot):
         
         return 0.1*old_weight + 0.9*new_weight
     
+    def weigh(self, particles):
+        """
+        Calculate the new weights of all particles at once, by looking
+        up the floor colours under all particles in one array
+        operation. See self.measurement_model().
+        Inputs:
+            particles: A ParticleSet with the moved particles and their
+                old weights.
+        Output:
+            An array with the new weights.
+        """
+        
+        colours = self.mapp.get_coordinates(particles.x, particles.y)
+        new_weights = colours == self.measurement
+        return 0.1*particles.weight + 0.9*new_weights
+    
+    def exact_measurements(self, particles):
+        """
+        Measure the floor colours at the positions of particles, for
+        the autonomous planner.
+        Inputs:
+            particles: A ParticleSet.
+        Output:
+            A uint8 array with the colours.
+        """
+        
+        return self.mapp.get_coordinates(particles.x, particles.y)
+    
     def autonome_move(self):
         """
         Find out an optimal direction to move in, and perform the move.
@@ -526,32 +1127,33 @@ class Robot2(Robot):
             enough.
         """
         
-        # Only use the 20% of the particles with the highest weight.
-        particles = sorted(self.particles, key=lambda p: p[1], reverse=True)
-        particles = [p[0] for p in particles[:self.num_particles//5]]
-        
-        # Create a root state with empty angles list and usability
-        # factor 0. States always contain
-        #   - A list with previously found angles.
-        #   - The usability factor of the state.
-        #   - A list of particles that must be used to find the best
-        #     directions. Particles are of the form (angle, (x, y)).
-        states = [([], 0, particles)]
-        depth = 4
-        
-        # Go depth steps deep to find the best direction under which to
-        # move the robot.
-        for i in range(depth):
-            # Only preserve the 3 best states to speed up calculations.
-            states = states[:3]
-            new_states = []
+        with self.phase('plan'):
+            # Only use the 20% of the particles with the highest weight.
+            order = np.argsort(-self.particles.weight, kind='stable')
+            particles = self.particles.take(order[:len(self.particles)//5])
+            
+            # Create a root state with empty angles list and usability
+            # factor 0. States always contain
+            #   - A list with previously found angles.
+            #   - The usability factor of the state.
+            #   - A ParticleSet with the particles that must be used to
+            #     find the best directions.
+            states = [([], 0, particles)]
+            depth = 4
             
-            # Calculate all the children states for the preserved
-            # states and add them to a new list of states. Sort the list
-            # based on the usability factor.
-            for state in states:
-                new_states.extend(self.new_states(state))
-            states = sorted(new_states, key=lambda s: s[1])
+            # Go depth steps deep to find the best direction under which to
+            # move the robot.
+            for i in range(depth):
+                # Only preserve the 3 best states to speed up calculations.
+                states = states[:3]
+                new_states = []
+                
+                # Calculate all the children states for the preserved
+                # states and add them to a new list of states. Sort the list
+                # based on the usability factor.
+                for state in states:
+                    new_states.extend(self.new_states(state))
+                states = sorted(new_states, key=lambda s: s[1])
         
         # Take the best angle (the one with the highest factor) from the
         # list and perform the actual move.
@@ -584,24 +1186,17 @@ class Robot2(Robot):
         # Loop through the list of angles that must be examined.
         for angle in angles:
             u = (angle, 1)
-            new_particles = []
             
             # Calculate the next pose for all particles, and measure at
-            # the same time.
-            count = {}
-            for p in particles:
-                _, new_part = self.motion_model(u, p, exact=True)
-                new_particles.append(new_part)
-                meas = self.measure(state=new_part)
-                if not meas in count:
-                    count[meas] = 1
-                else:
-                    count[meas] += 1
+            # the new poses.
+            new_particles = self.plan_motion(u, particles)
+            meas = self.plan_measure(new_particles)
             
             # Calculate the usability factor. This is the sum of the
             # squares of the frequencies of the floor colours measured
             # by the different particles. Lower is better.
-            factor = sum([c**2 for c in count.values()])
+            _, count = np.unique(meas, return_counts=True)
+            factor = int((count**2).sum())
             
             # Add a state to the list of new states.
             new_states.append((
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import math
+
+import numpy as np
+
+import geom
+
+class ScanTable:
+    
+    def __init__(self, mapp, half_measures, max_range, cell_size=0.2, angle_bins=1):
+        """
+        Initialize an empty table with exact range scans on a grid of
+        positions. Scans are only calculated when a cell is first
+        needed, so the table only grows where the robots look.
+        Inputs:
+            mapp: The Map object to scan.
+            half_measures: The number of beams per scan, see
+                robot.Robot1.
+            max_range: The maximal measuring distance.
+            cell_size: The distance between grid positions in meters.
+            angle_bins: The number of robot orientations for which
+                scans are stored. With 1 bin, only scans for
+                orientation 0 are stored.
+        """
+        
+        self.mapp = mapp
+        self.half_measures = half_measures
+        self.max_range = max_range
+        self.cell_size = cell_size
+        self.angle_bins = angle_bins
+        
+        # Scans are stored per (column, row, angle bin), in the format
+        # of robot.Robot1.scan().
+        self.scans = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def matches(self, half_measures, max_range):
+        """
+        Check if the table can answer scans for a robot.
+        """
+        
+        return half_measures == self.half_measures and max_range == self.max_range
+    
+    def bins(self, ang):
+        """
+        Find the stored scans that give the scans for orientations. A
+        scan at an orientation that differs a multiple of the beam
+        spacing pi/half_measures from a stored orientation is the stored
+        scan with its beams shifted, see self.lookup().
+        Inputs:
+            ang: An array with orientations.
+        Output:
+            A tuple (b, shift, valid) of arrays with the angle bins, the
+            shifts in beam directions and whether the orientation can be
+            looked up at all.
+        """
+        
+        ang = np.asarray(ang, dtype=float)
+        b = np.round(ang / (2*math.pi) * self.angle_bins)
+        steps = (ang - b * 2*math.pi / self.angle_bins) / (math.pi / self.half_measures)
+        shift = np.round(steps)
+        valid = np.abs(steps - shift) < 1e-9
+        b = b.astype(int) % self.angle_bins
+        shift = shift.astype(int) % (2*self.half_measures)
+        return b, shift, valid
+    
+    def lookup(self, x, y, ang=0):
+        """
+        Get interpolated exact scans at many locations. The scan at a
+        location is interpolated bilinearly between the scans at the 4
+        surrounding grid positions. The orientations must be valid
+        according to self.bins().
+        Inputs:
+            x: An array with x-coordinates.
+            y: An array with y-coordinates.
+            ang: The orientation of the robot, either a number or an
+                array with one orientation per location.
+        Output:
+            An array of shape (len(x), 2*half_measures) with distances.
+        """
+        
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        gx = x / self.cell_size
+        gy = y / self.cell_size
+        i = np.floor(gx).astype(int)
+        j = np.floor(gy).astype(int)
+        fx = (gx - i)[:, np.newaxis]
+        fy = (gy - j)[:, np.newaxis]
+        
+        b, shift, valid = self.bins(ang)
+        if not valid.all():
+            raise ValueError('orientation not in the scan table')
+        b = np.broadcast_to(b, x.shape)
+        shift = np.broadcast_to(shift, x.shape)
+        
+        # Get the scans at the 4 corners of all locations at once.
+        corners = self.get_scans(
+            np.concatenate((i, i+1, i, i+1)),
+            np.concatenate((j, j, j+1, j+1)),
+            np.concatenate((b, b, b, b))
+        )
+        c00, c10, c01, c11 = np.split(corners, 4)
+        scans = (
+            (1-fy) * ((1-fx) * c00 + fx * c10) +
+            fy * ((1-fx) * c01 + fx * c11)
+        )
+        
+        # Column 2k holds beam direction k and column 2k+1 direction
+        # k+half_measures, for the 2*half_measures directions pi /
+        # half_measures apart. Turning the robot over shift directions
+        # moves direction d+shift of the stored scan to direction d.
+        h = self.half_measures
+        c = np.arange(2*h)
+        d = (c//2 + (c % 2) * h + shift[:, np.newaxis]) % (2*h)
+        columns = np.where(d < h, 2*d, 2*(d-h) + 1)
+        return np.take_along_axis(scans, columns, axis=1)
+    
+    def get_scans(self, i, j, b):
+        """
+        Get the exact scans at grid positions, calculating the missing
+        ones in one batch.
+        Inputs:
+            i: An array with columns.
+            j: An array with rows.
+            b: An array with angle bins.
+        Output:
+            An array of shape (len(i), 2*half_measures).
+        """
+        
+        keys = list(zip(i.tolist(), j.tolist(), b.tolist()))
+        missing = list(set(k for k in keys if k not in self.scans))
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        
+        if missing:
+            cells = np.array(missing, dtype=float)
+            thetas = math.pi * np.arange(self.half_measures) / self.half_measures
+            angles = (cells[:, 2:3] * 2*math.pi / self.angle_bins) + thetas
+            pos, neg = geom.cast_rays(
+                cells[:, 0] * self.cell_size,
+                cells[:, 1] * self.cell_size,
+                angles,
+                self.mapp.wall_array,
+                self.max_range
+            )
+            distances = np.stack((pos, -neg), axis=-1).reshape(len(pos), -1)
+            distances = np.minimum(distances, self.max_range)
+            for k, scan in zip(missing, distances):
+                self.scans[k] = scan
+        
+        return np.array([self.scans[k] for k in keys])
+    
+    def state(self):
+        """
+        Get the contents of the table in a form that can be stored with
+        the map, see self.set_state().
+        """
+        
+        return {
+            'half_measures': self.half_measures,
+            'max_range': self.max_range,
+            'cell_size': self.cell_size,
+            'angle_bins': self.angle_bins,
+            'scans': self.scans
+        }
+    
+    def set_state(self, state):
+        """
+        Restore the contents of the table from self.state().
+        """
+        
+        self.half_measures = state['half_measures']
+        self.max_range = state['max_range']
+        self.cell_size = state['cell_size']
+        self.angle_bins = state['angle_bins']
+        self.scans = state['scans']
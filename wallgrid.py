@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import math
+
+import numpy as np
+
+import geom
+
+class WallGrid:
+    
+    def __init__(self, width, height, cell_size):
+        """
+        Initialize an empty uniform grid of buckets over the map. Every
+        wall is stored in all cells that its bounding box overlaps, so
+        that queries only have to look at the walls in nearby cells.
+        Inputs:
+            width: The width of the map in meters.
+            height: The height of the map in meters.
+            cell_size: The size of a cell in meters.
+        """
+        
+        self.cell_size = cell_size
+        self.nx = int(math.ceil(width / cell_size)) + 1
+        self.ny = int(math.ceil(height / cell_size)) + 1
+        
+        # The walls per cell. Only cells with walls are stored, so that
+        # large maps with few walls are cheap.
+        self.walls = []
+        self.cells = {}
+        
+        # Cached wall arrays per cell for self.near_walls(), see
+        # self.neighbours(). Only the cells that were queried are kept.
+        self.blocks = {}
+    
+    def cell(self, coor):
+        """
+        Get the cell that contains a coordinate. Coordinates outside
+        the grid are clamped to the closest cell.
+        Inputs:
+            coor: A tuple (x, y).
+        Output:
+            A tuple (i, j) with the column and row of the cell.
+        """
+        
+        i = int(math.floor(coor[0] / self.cell_size))
+        j = int(math.floor(coor[1] / self.cell_size))
+        return (min(max(i, 0), self.nx-1), min(max(j, 0), self.ny-1))
+    
+    def insert(self, wall):
+        """
+        Add a wall to the grid.
+        Inputs:
+            wall: A tuple ((x1, y1), (x2, y2)).
+        """
+        
+        index = len(self.walls)
+        self.walls.append(wall)
+        
+        i1, j1 = self.cell((min(wall[0][0], wall[1][0]), min(wall[0][1], wall[1][1])))
+        i2, j2 = self.cell((max(wall[0][0], wall[1][0]), max(wall[0][1], wall[1][1])))
+        for j in range(j1, j2+1):
+            for i in range(i1, i2+1):
+                self.cells.setdefault(j*self.nx + i, []).append(index)
+        
+        self.blocks = {}
+    
+    def candidates(self, box):
+        """
+        Get the walls that might intersect a rectangle.
+        Inputs:
+            box: A tuple ((x_min, y_min), (x_max, y_max)).
+        Output:
+            A set with the indices of the walls in self.walls.
+        """
+        
+        i1, j1 = self.cell(box[0])
+        i2, j2 = self.cell(box[1])
+        found = set()
+        for j in range(j1, j2+1):
+            for i in range(i1, i2+1):
+                found.update(self.cells.get(j*self.nx + i, ()))
+        return found
+    
+    def nearest(self, coor):
+        """
+        Calculate the exact distance to the closest wall. The cells are
+        searched in square rings around the cell of coor, until no cell
+        in the next ring can contain a closer wall.
+        Inputs:
+            coor: A tuple (x, y).
+        Output:
+            The distance to the closest wall.
+        """
+        
+        ci, cj = self.cell(coor)
+        max_ring = max(ci, cj, self.nx-1-ci, self.ny-1-cj)
+        
+        min_d = float('inf')
+        seen = set()
+        for r in range(max_ring+1):
+            
+            # Every cell in ring r or further is at least r-1 cells
+            # away from (the projection on the grid of) coor.
+            if min_d <= (r-1) * self.cell_size:
+                break
+            
+            for j in range(max(cj-r, 0), min(cj+r, self.ny-1)+1):
+                
+                # Only the left and right cells for the inner rows of
+                # the ring, the full row for the top and bottom.
+                if abs(j-cj) == r:
+                    columns = range(max(ci-r, 0), min(ci+r, self.nx-1)+1)
+                else:
+                    columns = [i for i in (ci-r, ci+r) if 0 <= i < self.nx]
+                
+                for i in columns:
+                    for index in self.cells.get(j*self.nx + i, ()):
+                        if index not in seen:
+                            seen.add(index)
+                            d = geom.dist_point_line(coor, self.walls[index])
+                            if d < min_d:
+                                min_d = d
+        
+        return min_d
+    
+    def neighbours(self, cell):
+        """
+        Get the walls in the 3x3 block of cells around a cell. Every
+        wall within one cell size of a point is in the block of the cell
+        of that point. Blocks are built when they are first needed.
+        Inputs:
+            cell: The index j*nx + i of the cell.
+        Output:
+            An array of shape (K, 4) with the walls as rows (x1, y1, x2,
+            y2).
+        """
+        
+        if cell not in self.blocks:
+            j, i = divmod(cell, self.nx)
+            block = set()
+            for jj in range(max(j-1, 0), min(j+1, self.ny-1)+1):
+                for ii in range(max(i-1, 0), min(i+1, self.nx-1)+1):
+                    block.update(self.cells.get(jj*self.nx + ii, ()))
+            self.blocks[cell] = np.array(
+                [self.walls[index] for index in sorted(block)], dtype=float
+            ).reshape(-1, 4)
+        
+        return self.blocks[cell]
+    
+    def near_walls(self, x, y):
+        """
+        Get the walls around many points at once, see
+        self.neighbours().
+        Inputs:
+            x: An array with x-coordinates.
+            y: An array with y-coordinates.
+        Output:
+            A tuple (walls, valid) of shapes x.shape + (K, 4) and
+            x.shape + (K,), where K is the largest number of walls
+            around a point. valid is False for the padding.
+        """
+        
+        i = np.clip(np.floor(x / self.cell_size).astype(int), 0, self.nx-1)
+        j = np.clip(np.floor(y / self.cell_size).astype(int), 0, self.ny-1)
+        cells, inverse = np.unique(j*self.nx + i, return_inverse=True)
+        
+        # Pad the blocks of the occupied cells to the same length.
+        blocks = [self.neighbours(c) for c in cells.tolist()]
+        k = max([len(b) for b in blocks] + [1])
+        walls = np.zeros((len(blocks), k, 4))
+        valid = np.zeros((len(blocks), k), dtype=bool)
+        for c, block in enumerate(blocks):
+            walls[c, :len(block)] = block
+            valid[c, :len(block)] = True
+        
+        inverse = inverse.reshape(np.shape(x))
+        return walls[inverse], valid[inverse]